@@ -1,17 +1,24 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 import os
+import threading
 
-from app.database import get_db, engine, Base
+from app.database import get_db, engine, Base, add_missing_columns
 from models.user import User
 from models.image import Image, MatchResult
 from utils.auth import get_password_hash
-from routers import auth, users, images
+from routers import auth, users, images, profiling
+from utils.reindex import REINDEX_ON_STARTUP
+from utils.cleanup import GC_INTERVAL_SECONDS
+from utils.profiling import ProfilingMiddleware, profiler, PROFILING_ENABLED
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+add_missing_columns()
 
 app = FastAPI(
     title="Human Match API",
@@ -28,10 +35,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profile sampled requests; not installed at all unless enabled
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(users.router, prefix="/api")
 app.include_router(images.router, prefix="/api")
+app.include_router(profiling.router, prefix="/api")
 
 # Create upload directories if they don't exist
 os.makedirs("uploads", exist_ok=True)
@@ -43,6 +55,14 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 @app.on_event("startup")
 async def startup_event():
+    # Load the heavy recognition backends without blocking startup; /ready
+    # reports when they are available
+    threading.Thread(target=images.face_service.warm_up, name="backend-warm-up", daemon=True).start()
+    
+    # Build the sharded index of a large reference gallery in the background;
+    # matches scan in-process until it is ready
+    images.gallery_indexes.warm(images.face_service.encoding_signature())
+    
     # Create admin user if it doesn't exist
     db = next(get_db())
     admin_user = db.query(User).filter(User.username == "admin").first()
@@ -57,6 +77,22 @@ async def startup_event():
         )
         db.add(admin_user)
         db.commit()
+    db.close()
+    
+    # Bring encodings from an older model, detector or library version up to date
+    if REINDEX_ON_STARTUP:
+        images.reindex_worker.start()
+    
+    # Periodically remove orphaned images, match results and files
+    images.image_cleaner.start_background(GC_INTERVAL_SECONDS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Stop background work and the match engine's shard processes
+    images.reindex_worker.stop()
+    images.image_cleaner.stop()
+    images.face_service.close()
+    images.gallery_indexes.close()
 
 @app.get("/")
 async def root():
@@ -64,4 +100,28 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    # Liveness: the process is up and serving requests
     return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check(db: Session = Depends(get_db)):
+    # Readiness: the database is reachable and the recognition backends are loaded
+    backends = images.face_service.backend_status()
+    try:
+        db.execute(text("SELECT 1"))
+        database_ok = True
+    except Exception:
+        database_ok = False
+    
+    ready = database_ok and all(backend["loaded"] for backend in backends.values())
+    if ready:
+        state = "ready"
+    elif any(backend["error"] for backend in backends.values()):
+        # A failed import is not retried in the background, so waiting will not help
+        state = "failed"
+    else:
+        state = "starting"
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": state, "database": database_ok, "backends": backends}
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, and_
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -12,11 +12,40 @@ class Image(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     face_encoding = Column(String)  # Stored as base64 encoded numpy array
     is_reference = Column(Boolean, default=False)  # Whether this image is in the reference database
+    # What produced face_encoding; encodings are only comparable when all three match
+    encoding_model = Column(String, nullable=True)
+    encoding_detector = Column(String, nullable=True)
+    encoding_version = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship with user
     user = relationship("User", back_populates="images")
 
+    @property
+    def encoding_signature(self):
+        """(model, detector, version) of the stored face encoding."""
+        return (self.encoding_model, self.encoding_detector, self.encoding_version)
+
+    @classmethod
+    def with_encoding_signature(cls, signature):
+        """Filter clause selecting images encoded with the given signature."""
+        model, detector, version = signature
+        return and_(
+            cls.encoding_model == model,
+            cls.encoding_detector == detector,
+            cls.encoding_version == version
+        )
+
+    @property
+    def thumbnail_url(self):
+        """URL of the downscaled preview (served by the images router)."""
+        return f"/api/derived/thumbnail/{self.filename}"
+
+    @property
+    def face_url(self):
+        """URL of the square crop around the detected face."""
+        return f"/api/derived/face/{self.filename}"
+
 class MatchResult(Base):
     __tablename__ = "match_results"
 
@@ -29,3 +58,16 @@ class MatchResult(Base):
     # Relationships
     source_image = relationship("Image", foreign_keys=[source_image_id])
     matched_image = relationship("Image", foreign_keys=[matched_image_id])
+
+class ReferenceGallery(Base):
+    """Change counters of the reference images sharing one encoding signature.
+
+    Counters are bumped in the same transaction as the change they record, so
+    every worker process sees the same generation of the gallery.
+    """
+    __tablename__ = "reference_galleries"
+
+    signature = Column(String, primary_key=True)  # "model/detector/version"
+    epoch = Column(Integer, nullable=False, default=0)  # Bumped when references are removed or re-encoded
+    additions = Column(Integer, nullable=False, default=0)  # Bumped when references are added
+    reference_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,10 @@
+from sqlalchemy import Column, String, Float
+from app.database import Base
+
+class BackgroundLease(Base):
+    """Claim of one worker process on a piece of background work shared by all workers."""
+    __tablename__ = "background_leases"
+
+    name = Column(String, primary_key=True)  # e.g. "reindex"
+    owner = Column(String, nullable=True)  # host:pid:token of the holder
+    expires_at = Column(Float, nullable=False, default=0)  # Unix time; free once it has passed
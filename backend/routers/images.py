@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, status
+from fastapi.responses import JSONResponse, FileResponse, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
 import os
 import shutil
 import uuid
 from datetime import datetime
 
 from app.database import get_db
-from utils.auth import get_current_active_user
+from utils.auth import get_current_active_user, get_current_admin_user
 from utils.face_recognition_util import FaceRecognitionService
+from utils.match_cache import MatchResultCache, CachedMatch
+from utils.galleries import gallery_key, record_change
+from utils.gallery_index import GalleryIndexes
+from utils.reindex import ReindexWorker, live_traffic
+from utils.cleanup import ImageCleaner, UPLOAD_EXTENSIONS
+from utils.thumbnails import DERIVATIVE_KINDS, derivative_path, generate_derivatives, create_thumbnail, create_face_crop
 from models.user import User
 from models.image import Image, MatchResult
 from pydantic import BaseModel
@@ -19,18 +26,42 @@ router = APIRouter(tags=["images"])
 # Initialize face recognition service
 face_service = FaceRecognitionService()
 
+# Sharded match engines for large reference galleries, built in the background
+gallery_indexes = GalleryIndexes(face_service.decode_from_base64)
+
+# Cache of /match results per query image and reference gallery generation
+match_cache = MatchResultCache()
+
+# Re-encodes images whose encoding predates the current model/detector/version
+reindex_worker = ReindexWorker(face_service)
+
+def _on_images_deleted(image_ids: List[int], removed_reference: bool):
+    # Keep the in-memory match indexes and cached results in step with
+    # deletions; the gallery generation was already bumped in the deleting transaction
+    gallery_indexes.remove(image_ids)
+    for image_id in image_ids:
+        match_cache.discard(image_id)
+
+# Deletes images with their match results and files, and collects orphans
+image_cleaner = ImageCleaner(on_deleted=_on_images_deleted)
+
 # Create upload directory if it doesn't exist
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_DIR, "reference"), exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_DIR, "query"), exist_ok=True)
 
+# Derivatives are immutable (uploads get unique names), so clients may cache them forever
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 class ImageResponse(BaseModel):
     id: int
     filename: str
     filepath: str
     created_at: datetime
     is_reference: bool
+    thumbnail_url: str
+    face_url: str
 
     class Config:
         orm_mode = True
@@ -46,7 +77,7 @@ class MatchResultResponse(BaseModel):
     class Config:
         orm_mode = True
 
-@router.post("/upload", response_model=ImageResponse)
+@router.post("/upload", response_model=ImageResponse, dependencies=[Depends(live_traffic.track)])
 async def upload_image(
     is_reference: bool = Form(False),
     file: UploadFile = File(...),
@@ -55,7 +86,7 @@ async def upload_image(
 ):
     """Upload an image and extract face encodings."""
     # Validate file type
-    if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+    if not file.filename.lower().endswith(UPLOAD_EXTENSIONS):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Only .png, .jpg, and .jpeg files are allowed"
@@ -73,10 +104,11 @@ async def upload_image(
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
-    # Extract face encoding
-    face_encoding = face_service.encode_face(file_path)
+    # Extract face location and encoding; with the CNN detector this joins a
+    # micro-batch with concurrent uploads, so await instead of blocking the loop
+    located_face = await asyncio.wrap_future(face_service.submit_locate_and_encode_face(file_path))
     
-    if face_encoding is None:
+    if located_face is None:
         # Clean up the file if no face was detected
         os.remove(file_path)
         raise HTTPException(
@@ -84,6 +116,14 @@ async def upload_image(
             detail="No face detected in the uploaded image"
         )
     
+    face_location, face_encoding = located_face
+    encoding_model, encoding_detector, encoding_version = face_service.encoding_signature()
+    
+    # Generate the thumbnail and face crop once, while the face box is known;
+    # decoding and resizing block, so they run in the default executor
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, generate_derivatives, file_path, unique_filename, face_location)
+    
     # Convert encoding to base64 for storage
     encoded_face = face_service.encode_to_base64(face_encoding)
     
@@ -93,13 +133,23 @@ async def upload_image(
         filepath=file_path,
         user_id=current_user.id,
         face_encoding=encoded_face,
+        encoding_model=encoding_model,
+        encoding_detector=encoding_detector,
+        encoding_version=encoding_version,
         is_reference=is_reference
     )
     
     db.add(db_image)
+    # Cached match results can be brought up to date with this reference;
+    # counted in the same transaction so every worker sees it
+    if is_reference:
+        record_change(db, db_image.encoding_signature, added=1)
     db.commit()
     db.refresh(db_image)
     
+    if is_reference:
+        gallery_indexes.add(db_image.encoding_signature, db_image.id, face_encoding)
+    
     return db_image
 
 @router.get("/images", response_model=List[ImageResponse])
@@ -134,13 +184,67 @@ async def get_image(
         
     return image
 
-@router.post("/match/{image_id}", response_model=Optional[MatchResultResponse])
-async def match_image(
+@router.get("/derived/{kind}/{filename}")
+async def get_derivative(
+    kind: str,
+    filename: str,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """Serve a thumbnail or face crop, generating it on first request."""
+    if kind not in DERIVATIVE_KINDS or os.path.basename(filename) != filename:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+    
+    path = derivative_path(kind, filename)
+    
+    if not os.path.exists(path):
+        # Lazily generate derivatives for images uploaded before they existed
+        image = db.query(Image).filter(Image.filename == filename).first()
+        
+        if image is None or not os.path.exists(image.filepath):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Image not found"
+            )
+        
+        loop = asyncio.get_running_loop()
+        if kind == "thumbnail":
+            await loop.run_in_executor(None, create_thumbnail, image.filepath, path)
+        else:
+            # Locate the face exactly as the upload path does: the box is in the
+            # raw (pre-EXIF-rotation) orientation that create_face_crop expects
+            located_face = await asyncio.wrap_future(face_service.submit_locate_and_encode_face(image.filepath))
+            if located_face is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="No face detected in the image"
+                )
+            await loop.run_in_executor(None, create_face_crop, image.filepath, path, located_face[0])
+    
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": DERIVATIVE_CACHE_CONTROL}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+@router.post("/match/{image_id}", response_model=Optional[MatchResultResponse],
+             dependencies=[Depends(live_traffic.track)])
+def match_image(
     image_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Match an uploaded image against the reference database."""
+    # A plain def: FastAPI runs it in its threadpool, so the scan and database
+    # reads never block the event loop
+    
     # Get the query image
     query_image = db.query(Image).filter(Image.id == image_id, Image.user_id == current_user.id).first()
     
@@ -150,28 +254,97 @@ async def match_image(
             detail="Image not found"
         )
     
-    # Get all reference images
-    reference_images = db.query(Image).filter(Image.is_reference == True).all()
+    # Only encodings produced by the same model, detector and version are
+    # comparable, so the gallery is the references sharing the query's signature
+    signature = query_image.encoding_signature
+    gallery = "reference:" + gallery_key(signature)
+    
+    # Serve repeat matches from the cache while the reference gallery is
+    # unchanged; read the generation before querying the references
+    generation = match_cache.gallery_generation(db, signature)
+    epoch, _, reference_count, _ = generation
     
-    if not reference_images:
+    if reference_count == 0:
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={"detail": "No reference images available for matching"}
         )
     
+    cached = match_cache.get(query_image.id)
+    if cached is not None and cached.generation == generation:
+        if cached.match_result_id is None:
+            return None
+        db_match = db.query(MatchResult).filter(MatchResult.id == cached.match_result_id).first()
+        if db_match is not None:
+            return db_match
+    
+    reference_query = db.query(Image).filter(
+        Image.is_reference == True,
+        Image.with_encoding_signature(signature)
+    )
+    
+    # If references were only added since the cached result, scan just those
+    incremental = (
+        cached is not None
+        and match_cache.incremental
+        and cached.generation[0] == epoch
+        and cached.generation[3] == signature
+        and cached.max_reference_id is not None
+    )
+    if incremental:
+        reference_images = reference_query.filter(Image.id > cached.max_reference_id).all()
+        # A reference committed out of id order shows up as a count mismatch
+        incremental = cached.generation[2] + len(reference_images) == reference_count
+    
     # Decode query image face encoding
     query_encoding = face_service.decode_from_base64(query_image.face_encoding)
     
-    # Prepare database encodings
-    database_encodings = [
-        (ref_img.id, face_service.decode_from_base64(ref_img.face_encoding))
-        for ref_img in reference_images
-    ]
+    indexed = None
+    if incremental:
+        max_reference_id = max((ref_img.id for ref_img in reference_images), default=cached.max_reference_id)
+    else:
+        # Large galleries are searched by their sharded index once it is built
+        # and current; otherwise the references are scanned in-process
+        indexed = gallery_indexes.search(db, signature, generation, query_encoding)
     
-    # Find the best match
-    match_result = face_service.find_match_in_database(query_encoding, database_encodings)
+    if indexed is not None:
+        candidates, max_reference_id = indexed
+        match_result = face_service.best_candidate(candidates, reference_count, gallery=gallery)
+    else:
+        if not incremental:
+            reference_images = reference_query.all()
+            if not reference_images:
+                return JSONResponse(
+                    status_code=status.HTTP_200_OK,
+                    content={"detail": "No reference images available for matching"}
+                )
+            max_reference_id = max(ref_img.id for ref_img in reference_images)
+        
+        # Prepare database encodings
+        database_encodings = [
+            (ref_img.id, face_service.decode_from_base64(ref_img.face_encoding))
+            for ref_img in reference_images
+        ]
+        
+        # Find the best match
+        match_result = face_service.find_match_in_database(
+            query_encoding, database_encodings, gallery=gallery, record_stats=not incremental
+        )
+    
+    if incremental and cached.match_result_id is not None and (
+        match_result is None or match_result["similarity"] <= cached.similarity
+    ):
+        # The previous best still wins; reuse its row instead of inserting a duplicate
+        db_match = db.query(MatchResult).filter(MatchResult.id == cached.match_result_id).first()
+        if db_match is not None:
+            match_cache.put(query_image.id, CachedMatch(
+                generation, max_reference_id, cached.matched_image_id, cached.similarity, cached.match_result_id
+            ))
+            return db_match
+        match_result = {"image_id": cached.matched_image_id, "similarity": cached.similarity}
     
     if match_result is None:
+        match_cache.put(query_image.id, CachedMatch(generation, max_reference_id))
         return None
     
     # Get the matched image
@@ -188,6 +361,10 @@ async def match_image(
     db.commit()
     db.refresh(db_match)
     
+    match_cache.put(query_image.id, CachedMatch(
+        generation, max_reference_id, matched_image.id, db_match.similarity_score, db_match.id
+    ))
+    
     # Include the matched image in the response
     setattr(db_match, "matched_image", matched_image)
     
@@ -214,3 +391,39 @@ async def get_match_history(
         setattr(result, "matched_image", matched_image)
     
     return match_results
+
+@router.get("/match-stats")
+async def get_match_stats(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Get best-match and impostor score statistics per gallery (admin only)."""
+    return {
+        "similarity_threshold": face_service.similarity_threshold,
+        "early_exit_enabled": face_service.early_exit,
+        "galleries": {
+            gallery: face_service.score_stats.get(gallery).to_dict(face_service.similarity_threshold)
+            for gallery in face_service.score_stats.galleries()
+        }
+    }
+
+@router.get("/reindex")
+async def get_reindex_status(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Get progress of re-encoding images with an outdated encoding version (admin only)."""
+    return reindex_worker.status()
+
+@router.post("/reindex")
+async def start_reindex(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Start re-encoding images with an outdated encoding version (admin only)."""
+    started = reindex_worker.start()
+    return {"started": started, **reindex_worker.status()}
+
+@router.post("/gc")
+async def collect_garbage(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Remove orphaned images, match results and files now (admin only)."""
+    return await asyncio.get_running_loop().run_in_executor(None, image_cleaner.collect_garbage)
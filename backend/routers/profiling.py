@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from utils.auth import get_current_admin_user
+from utils.profiling import profiler, PROFILING_ENABLED
+from models.user import User
+
+router = APIRouter(tags=["profiling"])
+
+@router.get("/profiles")
+async def get_profiles(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Get per-route summaries of the profiled requests (admin only)."""
+    return {
+        "enabled": PROFILING_ENABLED,
+        "sample_rate": profiler.sample_rate,
+        "interval_ms": profiler.interval * 1000,
+        "routes": profiler.summary()
+    }
+
+@router.get("/profiles/collapsed", response_class=PlainTextResponse)
+async def get_collapsed_stacks(
+    route: Optional[str] = None,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Get sampled stacks in collapsed format (admin only).
+    
+    Feed the output to flamegraph.pl or load it into speedscope to render a
+    flame graph. Without ``route`` (e.g. "POST /api/match/{image_id}") every
+    route is included, with the route as the root frame.
+    """
+    return profiler.collapsed(route)
+
+@router.delete("/profiles")
+async def reset_profiles(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Discard all collected samples (admin only)."""
+    profiler.reset()
+    return {"detail": "Profiles cleared"}
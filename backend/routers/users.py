@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List, Any
+import asyncio
 from pydantic import BaseModel, EmailStr
 
 from app.database import get_db
 from utils.auth import get_current_active_user, get_current_admin_user, get_password_hash
 from models.user import User
 from models.image import Image, MatchResult
+from routers.images import image_cleaner
 
 router = APIRouter(tags=["users"])
 
@@ -191,7 +193,9 @@ async def delete_user(
             detail="User not found"
         )
     
-    db.delete(user)
-    db.commit()
+    # Serialize before the row is gone, then delete the user's images, match
+    # results and files in batches along with the user
+    response = UserResponse.from_orm(user)
+    await asyncio.get_running_loop().run_in_executor(None, image_cleaner.delete_user, db, user)
     
-    return user
+    return response
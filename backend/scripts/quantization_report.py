@@ -0,0 +1,93 @@
+"""
+Recall / memory / latency report for the quantized match index.
+
+Compares each gallery representation in ``utils.quantization`` against the
+exact float64 ``face_distance`` scan on a synthetic gallery shaped like dlib
+face encodings (identities with several noisy samples each).
+
+Usage (from the backend directory):
+    python -m scripts.quantization_report --gallery 200000 --queries 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.quantization import create_quantizer, QUANTIZERS
+
+
+def make_gallery(size: int, queries: int, dim: int = 128, seed: int = 0):
+    """Build a synthetic gallery plus queries that each have one true mate."""
+    rng = np.random.default_rng(seed)
+    identities = max(1, size // 4)
+    centers = rng.normal(0, 0.06, size=(identities, dim))
+    labels = rng.integers(0, identities, size=size)
+    gallery = centers[labels] + rng.normal(0, 0.02, size=(size, dim))
+    mates = rng.choice(size, queries, replace=False)
+    query_encodings = gallery[mates] + rng.normal(0, 0.02, size=(queries, dim))
+    return gallery, query_encodings
+
+
+def exact_scan(gallery: np.ndarray, query: np.ndarray) -> np.ndarray:
+    # Same computation as face_recognition.face_distance
+    return np.linalg.norm(gallery - query, axis=1)
+
+
+def evaluate(name, gallery, queries, truth, rerank):
+    quantizer = create_quantizer(name)
+    if quantizer is None:
+        codes, memory = gallery, gallery.nbytes
+    else:
+        quantizer.fit(gallery)
+        codes = quantizer.encode(gallery)
+        memory = codes.nbytes
+
+    approx_hits = rerank_hits = 0
+    started = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        if quantizer is None:
+            distances = exact_scan(codes, query)
+            best = int(distances.argmin())
+            approx_hits += best == expected
+            rerank_hits += best == expected
+            continue
+        distances = quantizer.distances(query, codes)
+        shortlist = min(rerank, len(codes))
+        candidates = np.argpartition(distances, shortlist - 1)[:shortlist]
+        approx_hits += int(candidates[distances[candidates].argmin()]) == expected
+        # Exact float re-rank of the shortlist
+        exact = exact_scan(gallery[candidates], query)
+        rerank_hits += int(candidates[exact.argmin()]) == expected
+    elapsed = (time.perf_counter() - started) / len(queries)
+
+    return {
+        "name": name,
+        "bytes_per_face": memory // len(gallery),
+        "memory_mb": memory / 2 ** 20,
+        "recall": approx_hits / len(queries),
+        "recall_rerank": rerank_hits / len(queries),
+        "latency_ms": elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gallery", type=int, default=100000, help="Number of gallery encodings")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--rerank", type=int, default=32, help="Candidates re-ranked exactly (MATCH_RERANK)")
+    args = parser.parse_args()
+
+    gallery, queries = make_gallery(args.gallery, args.queries)
+    # Ground truth is the exact nearest neighbour, not the generating mate
+    truth = [int(exact_scan(gallery, query).argmin()) for query in queries]
+
+    print(f"Gallery: {args.gallery} faces, {args.queries} queries, re-rank depth {args.rerank}")
+    print(f"{'index':<8} {'B/face':>7} {'memory MB':>10} {'recall@1':>9} {'+re-rank':>9} {'ms/query':>9}")
+    for name in ["none"] + list(QUANTIZERS):
+        row = evaluate(name, gallery, queries, truth, args.rerank)
+        print(f"{row['name']:<8} {row['bytes_per_face']:>7} {row['memory_mb']:>10.1f} "
+              f"{row['recall']:>9.3f} {row['recall_rerank']:>9.3f} {row['latency_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
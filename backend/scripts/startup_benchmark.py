@@ -0,0 +1,168 @@
+"""
+Startup-time benchmark for the API.
+
+Measures, in fresh interpreter processes:
+  * import time of ``app.main`` (what every worker pays before serving),
+  * time until ``/health`` first answers (liveness) and its latency,
+  * time until ``/ready`` returns 200 (recognition backends loaded),
+  * with preloading disabled, the latency of the first request that needs a
+    recognition backend (an authenticated ``/api/upload``), which pays the
+    lazy dlib import.
+
+The server uses the configured database; the benchmark logs in with the
+default admin account.
+
+Usage (from the backend directory):
+    python -m scripts.startup_benchmark --runs 3
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from PIL import Image
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return 0
+
+
+def start_server(port: int, env: dict = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env={**os.environ, **(env or {})}
+    )
+
+
+def login(base_url: str) -> str:
+    data = urllib.parse.urlencode({"username": "admin", "password": "123456"}).encode()
+    with urllib.request.urlopen(f"{base_url}/token", data=data, timeout=10) as response:
+        return json.load(response)["access_token"]
+
+
+def upload_request(base_url: str, token: str) -> urllib.request.Request:
+    """Multipart /api/upload of a small blank image; detection runs even though it finds no face."""
+    image = io.BytesIO()
+    Image.new("RGB", (160, 160), (128, 128, 128)).save(image, "JPEG")
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"is_reference\"\r\n\r\nfalse\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"benchmark.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image.getvalue() + f"\r\n--{boundary}--\r\n".encode()
+    return urllib.request.Request(f"{base_url}/api/upload", data=body, headers={
+        "Authorization": f"Bearer {token}",
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+    })
+
+
+def measure_first_backend_request(timeout: float) -> float:
+    """Latency of the first /api/upload on a server that loads backends only on first use."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = start_server(port, {"PRELOAD_BACKENDS": ""})
+    try:
+        while get_status(f"{base_url}/health") != 200:
+            if time.perf_counter() - started > timeout:
+                return None
+            time.sleep(0.05)
+        request = upload_request(base_url, login(base_url))
+        request_started = time.perf_counter()
+        try:
+            urllib.request.urlopen(request, timeout=timeout).close()
+        except urllib.error.HTTPError:
+            # 400 "No face detected" is expected; the backend was still loaded and run
+            pass
+        return time.perf_counter() - request_started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure_server(timeout: float) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = start_server(port)
+    result = {"live": None, "first_request": None, "ready": None}
+    try:
+        while time.perf_counter() - started < timeout:
+            request_started = time.perf_counter()
+            if result["live"] is None and get_status(f"{base_url}/health") == 200:
+                result["live"] = time.perf_counter() - started
+                result["first_request"] = time.perf_counter() - request_started
+            if result["live"] is not None and get_status(f"{base_url}/ready") == 200:
+                result["ready"] = time.perf_counter() - started
+                break
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def summarize(label: str, values: list):
+    values = [value for value in values if value is not None]
+    if not values:
+        print(f"{label:<28} n/a")
+        return
+    print(f"{label:<28} median {statistics.median(values) * 1000:8.1f} ms   "
+          f"min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Number of cold starts to measure")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for /ready")
+    args = parser.parse_args()
+
+    os.environ.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    imports = [measure_import() for _ in range(args.runs)]
+    servers = [measure_server(args.timeout) for _ in range(args.runs)]
+    first_backend = [measure_first_backend_request(args.timeout) for _ in range(args.runs)]
+
+    print(f"Cold starts: {args.runs}")
+    summarize("import app.main", imports)
+    summarize("time to /health (live)", [run["live"] for run in servers])
+    summarize("first /health latency", [run["first_request"] for run in servers])
+    summarize("time to /ready", [run["ready"] for run in servers])
+    summarize("first backend request", first_backend)
+
+
+if __name__ == "__main__":
+    main()
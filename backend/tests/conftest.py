@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+import pytest
+
+# The application reads its settings and creates its upload directories when
+# it is imported, so point it at a scratch directory before any test does
+WORKDIR = tempfile.mkdtemp(prefix="human-match-tests-")
+os.chdir(WORKDIR)
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    "PRELOAD_BACKENDS": "",
+    "REINDEX_ON_STARTUP": "false",
+    "GC_INTERVAL_SECONDS": "0",
+})
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
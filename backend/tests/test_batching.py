@@ -0,0 +1,101 @@
+import threading
+import types
+
+import numpy as np
+import pytest
+
+import utils.face_recognition_util as face_recognition_util
+from utils.batching import MicroBatcher
+from utils.face_recognition_util import FaceRecognitionService, group_by_shape
+
+
+def test_items_are_batched_and_results_returned_in_order():
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(process, max_batch_size=4, max_wait=0.2)
+    try:
+        futures = [batcher.submit(item) for item in range(6)]
+        assert [future.result(timeout=2) for future in futures] == [0, 2, 4, 6, 8, 10]
+        assert max(len(batch) for batch in batches) <= 4
+        assert len(batches) < 6
+    finally:
+        batcher.close()
+
+
+def test_batch_error_is_set_on_every_future_and_worker_survives():
+    def process(items):
+        if "bad" in items:
+            raise ValueError("boom")
+        return items
+
+    batcher = MicroBatcher(process, max_batch_size=2, max_wait=0.1)
+    try:
+        futures = [batcher.submit("bad"), batcher.submit("other")]
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=2)
+        assert batcher.submit("ok").result(timeout=2) == "ok"
+    finally:
+        batcher.close()
+
+
+def test_cancelled_future_does_not_kill_the_worker():
+    release = threading.Event()
+
+    def process(items):
+        release.wait(2)
+        return items
+
+    batcher = MicroBatcher(process, max_batch_size=1, max_wait=0.01)
+    try:
+        blocker = batcher.submit("first")
+        cancelled = batcher.submit("second")
+        assert cancelled.cancel()
+        release.set()
+        assert blocker.result(timeout=2) == "first"
+        assert batcher.submit("third").result(timeout=2) == "third"
+    finally:
+        batcher.close()
+
+
+def test_group_by_shape_keeps_padding_bounded():
+    shapes = [(480, 640), (4000, 3000), (500, 640), (640, 480), (3900, 3000), (100, 100)]
+    groups = group_by_shape(shapes, max_padding=1.5)
+    assert groups == [[1, 4], [2, 0, 3], [5]]
+    for group in groups:
+        canvas = max(shapes[i][0] for i in group) * max(shapes[i][1] for i in group)
+        assert all(canvas <= 1.5 * shapes[i][0] * shapes[i][1] for i in group)
+
+
+def test_large_image_is_detected_outside_the_padded_batch(monkeypatch):
+    images = {"small1": np.ones((100, 120, 3), np.uint8), "small2": np.ones((110, 120, 3), np.uint8),
+              "large": np.ones((2000, 1500, 3), np.uint8)}
+    calls = []
+
+    def batch_face_locations(batch, number_of_times_to_upsample, batch_size):
+        calls.append(("batch", [image.shape[:2] for image in batch]))
+        return [[(10, 50, 50, 10)] for _ in batch]
+
+    def face_locations(image, number_of_times_to_upsample, model):
+        calls.append(("single", image.shape[:2]))
+        return [(10, 50, 50, 10)]
+
+    backend = types.SimpleNamespace(
+        load_image_file=images.__getitem__,
+        batch_face_locations=batch_face_locations,
+        face_locations=face_locations,
+        face_encodings=lambda image, locations: [np.full(128, image.shape[0], dtype=np.float64)],
+    )
+    monkeypatch.setitem(face_recognition_util._backends, "face_recognition", backend)
+    service = FaceRecognitionService()
+    try:
+        results = service._locate_and_encode_batch(["small1", "large", "small2"])
+    finally:
+        service.close()
+
+    assert sorted(calls) == [("batch", [(110, 120), (110, 120)]), ("single", (2000, 1500))]
+    assert [result[1][0] for result in results] == [100, 2000, 110]
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from models.image import Image, MatchResult
+from models.user import User
+from utils.cleanup import ImageCleaner
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def add_image(db, user_id, path, is_reference=True):
+    image = Image(filename=os.path.basename(path), filepath=str(path), user_id=user_id,
+                  is_reference=is_reference)
+    db.add(image)
+    db.commit()
+    return image
+
+
+def test_delete_user_cascades_to_images_matches_and_files(session_factory, tmp_path):
+    db = session_factory()
+    user = User(username="u", email="u@example.com", hashed_password="x")
+    other = User(username="o", email="o@example.com", hashed_password="x")
+    db.add_all([user, other])
+    db.commit()
+    files = [tmp_path / f"{index}.jpg" for index in range(3)]
+    for path in files:
+        path.write_bytes(b"x")
+    owned = [add_image(db, user.id, path) for path in files[:2]]
+    kept = add_image(db, other.id, files[2], is_reference=False)
+    db.add(MatchResult(source_image_id=kept.id, matched_image_id=owned[0].id, similarity_score=0.99))
+    db.commit()
+    owned_ids = [image.id for image in owned]
+
+    deleted = []
+    cleaner = ImageCleaner(session_factory, on_deleted=lambda ids, ref: deleted.append((sorted(ids), ref)),
+                           batch_size=1, unlink_workers=2)
+    counts = cleaner.delete_user(db, user)
+
+    assert counts == {"images": 2, "match_results": 1, "files": 2}
+    assert deleted == [([owned_ids[0]], True), ([owned_ids[1]], True)]
+    assert db.query(User).filter(User.username == "u").count() == 0
+    assert db.query(Image).count() == 1
+    assert db.query(MatchResult).count() == 0
+    assert [path.exists() for path in files] == [False, False, True]
+
+
+def test_unreferenced_lookups_use_exact_names(session_factory):
+    db = session_factory()
+    add_image(db, 1, "uploads/reference/keep.JPG")
+    names = [f"gone{index}.jpg" for index in range(1200)] + ["keep.jpg"]
+    assert ImageCleaner._unreferenced_derivatives(db, names) == names[:-1]
+    assert ImageCleaner._unreferenced_uploads(db, ["keep.JPG", "gone.jpg"]) == ["gone.jpg"]
+
+
+def test_collect_garbage_removes_orphaned_rows(session_factory):
+    db = session_factory()
+    orphan = add_image(db, 999, "missing.jpg")
+    db.add(MatchResult(source_image_id=12345, matched_image_id=12346, similarity_score=0.5))
+    db.commit()
+    orphan_id = orphan.id
+
+    deleted = []
+    cleaner = ImageCleaner(session_factory, on_deleted=lambda ids, ref: deleted.extend(ids))
+    counts = cleaner.collect_garbage()
+
+    assert counts["images"] == 1
+    assert counts["match_results"] == 1
+    assert deleted == [orphan_id]
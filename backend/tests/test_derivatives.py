@@ -0,0 +1,67 @@
+import os
+import uuid
+
+from PIL import Image as PILImage
+
+from app.database import SessionLocal
+from models.image import Image
+from utils.thumbnails import _EXIF_ORIENTATION, create_face_crop
+
+
+def add_upload(size=(640, 480)):
+    filename = f"{uuid.uuid4()}.jpg"
+    path = os.path.join("uploads", "reference", filename)
+    PILImage.new("RGB", size, (200, 10, 10)).save(path, "JPEG")
+    db = SessionLocal()
+    db.add(Image(filename=filename, filepath=path, user_id=1, is_reference=True))
+    db.commit()
+    db.close()
+    return filename
+
+
+def test_thumbnail_is_generated_lazily_and_revalidated(client):
+    filename = add_upload()
+    response = client.get(f"/api/derived/thumbnail/{filename}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    with open(os.path.join("uploads", "derived", "thumbnail", filename), "rb") as f:
+        thumbnail = PILImage.open(f)
+        assert max(thumbnail.size) == 400
+
+    response = client.get(f"/api/derived/thumbnail/{filename}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    response = client.get(f"/api/derived/thumbnail/{filename}", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+def test_unknown_derivatives_are_not_found(client):
+    assert client.get(f"/api/derived/thumbnail/{uuid.uuid4()}.jpg").status_code == 404
+    assert client.get(f"/api/derived/original/{add_upload()}").status_code == 404
+
+
+def test_face_crop_is_taken_in_raw_orientation(tmp_path):
+    # Raw pixels: the face box is red in its top half and green in its bottom half
+    raw = PILImage.new("RGB", (300, 100), (0, 0, 255))
+    raw.paste((255, 0, 0), (100, 20, 160, 50))
+    raw.paste((0, 255, 0), (100, 50, 160, 80))
+    exif = raw.getexif()
+    # Displayed rotated 90 degrees clockwise
+    exif[_EXIF_ORIENTATION] = 6
+    source = tmp_path / "rotated.jpg"
+    raw.save(source, "JPEG", exif=exif, quality=95)
+
+    dest = tmp_path / "face.jpg"
+    create_face_crop(str(source), str(dest), (20, 160, 80, 100), size=100)
+
+    with PILImage.open(dest) as crop:
+        assert crop.size == (100, 100)
+        # After rotating clockwise the top half of the box is on the right
+        red, green, blue = crop.getpixel((75, 50))
+        assert red > 200 and green < 60
+        red, green, blue = crop.getpixel((25, 50))
+        assert green > 200 and red < 60
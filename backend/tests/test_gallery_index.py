@@ -0,0 +1,174 @@
+import base64
+import time
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from models.image import Image
+from models.user import User
+from utils.galleries import read_generation, record_change
+from utils.gallery_index import GalleryIndexes
+
+SIGNATURE = ("model", "hog", "v1")
+
+
+def encode(encoding):
+    return base64.b64encode(encoding.tobytes()).decode("utf-8")
+
+
+def decode(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float64)
+
+
+def add_references(db, encodings):
+    images = [
+        Image(filename=f"{index}.jpg", filepath="", user_id=1, is_reference=True, face_encoding=encode(encoding),
+              encoding_model=SIGNATURE[0], encoding_detector=SIGNATURE[1], encoding_version=SIGNATURE[2])
+        for index, encoding in enumerate(encodings)
+    ]
+    record_change(db, SIGNATURE, added=len(images))
+    db.add_all(images)
+    db.commit()
+    return images
+
+
+def wait_for(indexes):
+    deadline = time.time() + 60
+    while indexes._pending and time.time() < deadline:
+        time.sleep(0.05)
+    assert not indexes._pending
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(User(id=1, username="u", email="u@example.com", hashed_password="x"))
+    db.commit()
+    db.close()
+    return factory
+
+
+@pytest.fixture
+def gallery(session_factory):
+    rng = np.random.default_rng(0)
+    db = session_factory()
+    images = add_references(db, rng.random((60, 128)))
+    yield db, images
+    db.close()
+
+
+def search(indexes, db, query):
+    generation = read_generation(db, SIGNATURE) + (SIGNATURE,)
+    return indexes.search(db, SIGNATURE, generation, query)
+
+
+def test_index_is_built_in_the_background(session_factory, gallery):
+    db, images = gallery
+    indexes = GalleryIndexes(decode, session_factory, num_shards=2, min_gallery=10)
+    try:
+        query = decode(images[5].face_encoding)
+        # The first search only starts the build; the caller scans in-process
+        assert search(indexes, db, query) is None
+        wait_for(indexes)
+        candidates, max_id = search(indexes, db, query)
+        assert candidates[0][0] == images[5].id
+        assert max_id == images[-1].id
+    finally:
+        indexes.close()
+
+
+def test_small_galleries_are_not_indexed(session_factory, gallery):
+    db, images = gallery
+    indexes = GalleryIndexes(decode, session_factory, num_shards=2, min_gallery=1000)
+    indexes.warm(SIGNATURE)
+    wait_for(indexes)
+    assert search(indexes, db, decode(images[0].face_encoding)) is None
+    assert not indexes._indexes
+
+
+def test_additions_from_other_workers_are_caught_up(session_factory, gallery):
+    db, images = gallery
+    indexes = GalleryIndexes(decode, session_factory, num_shards=2, min_gallery=10)
+    try:
+        indexes.warm(SIGNATURE)
+        wait_for(indexes)
+        # Committed through another session, as another worker would
+        other = session_factory()
+        added_id = add_references(other, [np.full(128, 0.5)])[0].id
+        other.close()
+        candidates, max_id = search(indexes, db, np.full(128, 0.5))
+        assert candidates[0] == (added_id, 1.0)
+        assert max_id == added_id
+        assert not indexes._pending
+    finally:
+        indexes.close()
+
+
+def test_epoch_change_resyncs_in_the_background(session_factory, gallery):
+    db, images = gallery
+    indexes = GalleryIndexes(decode, session_factory, num_shards=2, min_gallery=10)
+    try:
+        indexes.warm(SIGNATURE)
+        wait_for(indexes)
+        deleted = images[5]
+        query = decode(deleted.face_encoding)
+        record_change(db, SIGNATURE, removed=1)
+        db.delete(deleted)
+        db.commit()
+        # Deleted by another worker: this index still holds the image
+        assert search(indexes, db, query) is None
+        wait_for(indexes)
+        candidates, _ = search(indexes, db, query)
+        assert candidates[0][0] != deleted.id
+        assert len(indexes._indexes[SIGNATURE].engine) == 59
+    finally:
+        indexes.close()
+
+
+def test_broken_engine_is_rebuilt(session_factory, gallery):
+    db, images = gallery
+    indexes = GalleryIndexes(decode, session_factory, num_shards=2, min_gallery=10)
+    try:
+        indexes.warm(SIGNATURE)
+        wait_for(indexes)
+        engine = indexes._indexes[SIGNATURE].engine
+        engine._processes[0].kill()
+        engine._processes[0].join()
+        # The failed search falls back to an in-process scan and starts a rebuild
+        assert search(indexes, db, decode(images[0].face_encoding)) is None
+        assert SIGNATURE not in indexes._indexes
+        assert search(indexes, db, decode(images[0].face_encoding)) is None
+        wait_for(indexes)
+        assert search(indexes, db, decode(images[0].face_encoding))[0][0][0] == images[0].id
+    finally:
+        indexes.close()
+
+
+def test_quantized_index_loads_only_the_shortlist(session_factory, gallery):
+    db, images = gallery
+    indexes = GalleryIndexes(decode, session_factory, num_shards=2, quantization="int8", rerank=4, min_gallery=10)
+    try:
+        indexes.warm(SIGNATURE)
+        wait_for(indexes)
+        query = decode(images[7].face_encoding)
+        generation = read_generation(db, SIGNATURE) + (SIGNATURE,)
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.get_bind(), "before_cursor_execute", listener)
+        try:
+            candidates, _ = indexes.search(db, SIGNATURE, generation, query)
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", listener)
+        assert len(candidates) == 4
+        assert max(candidates, key=lambda candidate: candidate[1]) == (images[7].id, 1.0)
+        # One query for the float encodings of the four shortlisted ids
+        assert len(statements) == 1
+        assert statements[0].count("?") == 4
+    finally:
+        indexes.close()
@@ -0,0 +1,99 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from models.image import Image
+from models.user import User
+from utils.cleanup import ImageCleaner
+from utils.galleries import read_generation, record_change
+from utils.match_cache import CachedMatch, MatchResultCache
+
+SIGNATURE = ("model", "hog", "v1")
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def test_gallery_counts_existing_references(session_factory):
+    db = session_factory()
+    db.add(User(id=1, username="u", email="u@example.com", hashed_password="x"))
+    db.add_all([
+        Image(filename=f"{index}.jpg", filepath=f"{index}.jpg", user_id=1, is_reference=True,
+              encoding_model=SIGNATURE[0], encoding_detector=SIGNATURE[1], encoding_version=SIGNATURE[2])
+        for index in range(3)
+    ])
+    db.commit()
+    assert read_generation(db, SIGNATURE) == (0, 0, 3)
+
+
+def test_generation_changes_on_addition_and_removal(session_factory):
+    db = session_factory()
+    initial = MatchResultCache.gallery_generation(db, SIGNATURE)
+    record_change(db, SIGNATURE, added=1)
+    db.commit()
+    added = MatchResultCache.gallery_generation(db, SIGNATURE)
+    assert added != initial
+    # Additions keep the epoch, so an incremental rescan stays possible
+    assert added[0] == initial[0]
+    record_change(db, SIGNATURE, removed=1)
+    db.commit()
+    assert MatchResultCache.gallery_generation(db, SIGNATURE)[0] != added[0]
+
+
+def test_changes_are_visible_to_other_sessions(session_factory):
+    # Stands in for a second worker process sharing the database
+    writer, reader = session_factory(), session_factory()
+    before = read_generation(reader, SIGNATURE)
+    record_change(writer, SIGNATURE, invalidate=True)
+    writer.commit()
+    reader.commit()
+    assert read_generation(reader, SIGNATURE)[0] == before[0] + 1
+
+
+def test_deleting_references_bumps_the_epoch(session_factory):
+    db = session_factory()
+    db.add(User(id=1, username="u", email="u@example.com", hashed_password="x"))
+    references = [
+        Image(filename=f"{index}.jpg", filepath="", user_id=1, is_reference=True,
+              encoding_model=SIGNATURE[0], encoding_detector=SIGNATURE[1], encoding_version=SIGNATURE[2])
+        for index in range(2)
+    ]
+    db.add_all(references)
+    db.commit()
+    epoch = read_generation(db, SIGNATURE)[0]
+
+    ImageCleaner(session_factory).delete_images(db, [references[0].id])
+    assert read_generation(db, SIGNATURE) == (epoch + 1, 0, 1)
+
+
+def test_additions_are_counted_per_signature(session_factory):
+    db = session_factory()
+    other = ("model", "cnn", "v1")
+    before = read_generation(db, other)
+    record_change(db, SIGNATURE, added=1)
+    db.commit()
+    assert read_generation(db, other) == before
+
+
+def test_lru_eviction_and_discard():
+    cache = MatchResultCache(max_size=2)
+    generation = (0, 0, 0, SIGNATURE)
+    for image_id in (1, 2):
+        cache.put(image_id, CachedMatch(generation, max_reference_id=10))
+    cache.get(1)
+    cache.put(3, CachedMatch(generation))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    cache.discard(1)
+    assert cache.get(1) is None
+
+
+def test_zero_size_disables_cache():
+    cache = MatchResultCache(max_size=0)
+    cache.put(1, CachedMatch((0, 0, 0, SIGNATURE)))
+    assert cache.get(1) is None
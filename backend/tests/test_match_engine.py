@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from utils.match_engine import ShardedMatchEngine, _ShardStore
+from utils.quantization import Int8Quantizer
+
+
+def make_gallery(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(image_id, rng.random(128)) for image_id in range(1, size + 1)]
+
+
+def exact_top_k(gallery, query, k):
+    distances = [(float(np.linalg.norm(encoding - query)), image_id) for image_id, encoding in gallery]
+    return [image_id for _, image_id in sorted(distances)[:k]]
+
+
+@pytest.fixture
+def engine():
+    engine = ShardedMatchEngine(3)
+    yield engine
+    engine.close()
+
+
+def test_shard_store_search_orders_by_distance():
+    store = _ShardStore()
+    gallery = make_gallery(50)
+    store.add(np.array([image_id for image_id, _ in gallery]), store.encode(np.vstack([e for _, e in gallery])))
+    query = gallery[7][1]
+    results = store.search(query, 5)
+    assert [image_id for _, image_id in results] == exact_top_k(gallery, query, 5)
+    assert results[0] == (0.0, 8)
+
+
+def test_shard_store_remove_and_pop_keep_rows_consistent():
+    store = _ShardStore()
+    gallery = make_gallery(10)
+    store.add(np.array([image_id for image_id, _ in gallery]), store.encode(np.vstack([e for _, e in gallery])))
+    assert store.remove([3, 3, 99]) == 1
+    ids, codes = store.pop(2)
+    assert store.size == 7
+    assert sorted(store.rows) == sorted(int(i) for i in store.ids[:store.size])
+    assert not set(ids.tolist()) & set(store.rows)
+    assert codes.shape == (2, 128)
+
+
+def test_search_merges_shards_like_exact_scan(engine):
+    gallery = make_gallery(300)
+    engine.add(gallery)
+    query = np.random.default_rng(1).random(128)
+    results = engine.search(query, k=10)
+    assert [image_id for image_id, _ in results] == exact_top_k(gallery, query, 10)
+    distances = [distance for _, distance in results]
+    assert distances == sorted(distances)
+
+
+def test_remove_rebalances_shards(engine):
+    gallery = make_gallery(300)
+    engine.add(gallery)
+    # Empty one shard entirely
+    first_shard = [image_id for image_id, shard in engine._locations.items() if shard == 0]
+    engine.remove(first_shard)
+    assert len(engine) == 300 - len(first_shard)
+    assert max(engine._sizes) - min(engine._sizes) <= max(1, 0.1 * len(engine) / engine.num_shards)
+    remaining = [item for item in gallery if item[0] not in first_shard]
+    query = remaining[0][1]
+    assert engine.search(query, k=1)[0][0] == remaining[0][0]
+
+
+def test_sync_applies_only_the_diff(engine):
+    gallery = make_gallery(110)
+    encodings = dict(gallery)
+    loaded = []
+
+    def load(image_ids):
+        loaded.extend(image_ids)
+        return [(image_id, encodings[image_id]) for image_id in image_ids]
+
+    assert engine.sync(range(1, 101), load) == (0, 100)
+    loaded.clear()
+    assert engine.sync(range(21, 111), load) == (20, 10)
+    assert sorted(loaded) == list(range(101, 111))
+    assert sorted(engine.ids()) == list(range(21, 111))
+
+
+def test_failed_search_marks_engine_broken_and_drains_replies(engine):
+    engine.add(make_gallery(30))
+    with pytest.raises(RuntimeError):
+        # Wrong dimensionality fails in every shard
+        engine.search(np.zeros(3), k=1)
+    assert engine.broken
+    with pytest.raises(RuntimeError):
+        engine.search(np.zeros(128), k=1)
+
+
+def test_quantized_search_returns_approximate_candidates():
+    gallery = make_gallery(200)
+    quantizer = Int8Quantizer().fit(np.vstack([e for _, e in gallery]))
+    engine = ShardedMatchEngine(2, quantizer=quantizer)
+    try:
+        engine.add(gallery)
+        query = gallery[42][1]
+        candidates = [image_id for image_id, _ in engine.search(query, k=5)]
+        assert gallery[42][0] in candidates
+    finally:
+        engine.close()
@@ -0,0 +1,60 @@
+import time
+from collections import Counter
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils.profiling import OVERFLOW_LABEL, ProfilingMiddleware, SamplingProfiler, route_name
+
+
+def record(profiler, route, stacks):
+    token = profiler.begin(0)
+    profiler._active[token][1].update(stacks)
+    profiler.end(token, route, 0.01)
+
+
+def test_forced_profiling_requires_the_token():
+    profiler = SamplingProfiler(sample_rate=0, token="secret")
+    assert profiler.should_profile([(b"x-profile", b"secret")])
+    assert not profiler.should_profile([(b"x-profile", b"1")])
+    assert not profiler.should_profile([])
+    # Without a configured token the header is ignored
+    assert not SamplingProfiler(sample_rate=0, token="").should_profile([(b"x-profile", b"")])
+
+
+def test_routes_and_stacks_are_bounded():
+    profiler = SamplingProfiler(max_routes=2, max_stacks=2)
+    record(profiler, "GET /a", Counter({"a;b": 1}))
+    record(profiler, "GET /b", Counter({"a;c": 1}))
+    record(profiler, "GET /unknown-1", Counter({"a;d": 1}))
+    record(profiler, "GET /unknown-2", Counter({"a;e": 1}))
+    assert set(profiler.summary()) == {"GET /a", "GET /b", OVERFLOW_LABEL}
+    assert profiler.summary()[OVERFLOW_LABEL]["requests"] == 2
+
+    record(profiler, "GET /a", Counter({"a;x": 2, "a;y": 3}))
+    assert sorted(profiler.collapsed("GET /a").splitlines()) == sorted(["a;b 1", "a;x 2", f"{OVERFLOW_LABEL} 3"])
+
+
+def test_unmatched_paths_share_one_route():
+    assert route_name({"method": "GET", "path": "/random/123"}) == "GET <unmatched>"
+
+
+def test_middleware_samples_forced_requests():
+    profiler = SamplingProfiler(sample_rate=0, interval=0.002, token="secret")
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+    @app.get("/slow/{item_id}")
+    def slow(item_id: int):
+        time.sleep(0.1)
+        return {"item_id": item_id}
+
+    with TestClient(app) as client:
+        headers = {"X-Profile": "secret"}
+        assert client.get("/slow/1", headers=headers).status_code == 200
+        assert client.get("/slow/2").status_code == 200
+        assert client.get("/missing", headers=headers).status_code == 404
+
+    summary = profiler.summary()
+    assert summary["GET /slow/{item_id}"]["requests"] == 1
+    assert summary["GET <unmatched>"]["requests"] == 1
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from utils.quantization import QUANTIZERS, ProductQuantizer, create_quantizer
+
+
+@pytest.fixture
+def encodings():
+    return np.random.default_rng(0).normal(0, 0.1, size=(600, 128))
+
+
+@pytest.mark.parametrize("name", sorted(QUANTIZERS))
+def test_codes_have_declared_shape_and_dtype(name, encodings):
+    quantizer = create_quantizer(name).fit(encodings)
+    codes = quantizer.encode(encodings)
+    assert codes.shape == (len(encodings),) + quantizer.code_shape(128)
+    assert quantizer.decode(codes).shape == encodings.shape
+
+
+@pytest.mark.parametrize("name", sorted(QUANTIZERS))
+def test_distances_approximate_exact_distances(name, encodings):
+    quantizer = create_quantizer(name).fit(encodings)
+    codes = quantizer.encode(encodings)
+    query = encodings[5] + 0.01
+    exact = np.linalg.norm(encodings - query, axis=1)
+    approximate = quantizer.distances(query, codes)
+    assert approximate.shape == exact.shape
+    # Distances to the decoded gallery are what the quantizer computes
+    decoded = np.linalg.norm(quantizer.decode(codes) - query, axis=1)
+    assert np.allclose(approximate, decoded, atol=1e-3)
+    # And the true nearest neighbour stays in a short list
+    assert int(exact.argmin()) in np.argsort(approximate)[:10]
+
+
+def test_product_quantizer_uses_one_byte_per_subspace(encodings):
+    quantizer = ProductQuantizer(num_subspaces=16, num_centroids=64, iterations=5).fit(encodings)
+    codes = quantizer.encode(encodings)
+    assert codes.dtype == np.uint8
+    assert codes.shape == (len(encodings), 16)
+
+
+def test_create_quantizer_none_and_unknown():
+    assert create_quantizer(None) is None
+    assert create_quantizer("none") is None
+    with pytest.raises(ValueError):
+        create_quantizer("bogus")
@@ -0,0 +1,24 @@
+import utils.face_recognition_util as face_recognition_util
+
+
+def test_ready_without_preloaded_backends(client):
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready", "database": True, "backends": {}}
+
+
+def test_ready_reports_backend_import_errors(client, monkeypatch):
+    from routers.images import face_service
+
+    monkeypatch.setattr(face_recognition_util, "PRELOAD_BACKENDS", ["broken"])
+    monkeypatch.setitem(face_recognition_util.BACKEND_MODULES, "broken", "no_such_backend_module")
+    monkeypatch.setattr(face_recognition_util, "_backend_errors", {})
+
+    assert client.get("/ready").json()["status"] == "starting"
+    face_service.warm_up()
+    response = client.get("/ready")
+    assert response.status_code == 503
+    body = response.json()
+    assert body["status"] == "failed"
+    assert body["backends"]["broken"]["loaded"] is False
+    assert "no_such_backend_module" in body["backends"]["broken"]["error"]
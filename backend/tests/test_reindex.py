@@ -0,0 +1,167 @@
+import asyncio
+import os
+import struct
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from models.image import Image
+from models.user import User
+from utils.galleries import read_generation
+from utils.leases import Lease
+from utils.reindex import LiveTraffic, ReindexWorker
+
+OLD = ("model", "hog", "v0")
+NEW = ("model", "hog", "v1")
+
+
+class FakeFaceService:
+    models = {"face_recognition": "hog"}
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.encoded = []
+
+    def encoding_signature(self):
+        return NEW
+
+    def locate_and_encode_face(self, path):
+        if path in self.missing:
+            return None
+        self.encoded.append(path)
+        return (0, 1, 1, 0), np.zeros(128)
+
+    def encode_to_base64(self, encoding):
+        return "encoded"
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(User(id=1, username="u", email="u@example.com", hashed_password="x"))
+    db.commit()
+    db.close()
+    return factory
+
+
+def add_images(session_factory, count, signature, is_reference=True):
+    db = session_factory()
+    db.add_all([
+        Image(filename=f"{signature[2]}-{index}.jpg", filepath=f"{signature[2]}-{index}.jpg", user_id=1,
+              is_reference=is_reference, encoding_model=signature[0], encoding_detector=signature[1],
+              encoding_version=signature[2])
+        for index in range(count)
+    ])
+    db.commit()
+    db.close()
+
+
+def run(worker):
+    assert worker.start()
+    worker._thread.join(timeout=30)
+    assert not worker.running
+
+
+def make_worker(face_service, session_factory, tmp_path, **kwargs):
+    return ReindexWorker(face_service, session_factory, batch_size=2, duty_cycle=1,
+                         traffic=LiveTraffic(str(tmp_path / "traffic")), **kwargs)
+
+
+def test_only_outdated_images_are_reencoded(session_factory, tmp_path):
+    add_images(session_factory, 3, OLD)
+    add_images(session_factory, 2, NEW)
+    face_service = FakeFaceService()
+    worker = make_worker(face_service, session_factory, tmp_path)
+    run(worker)
+    assert sorted(face_service.encoded) == [f"v0-{index}.jpg" for index in range(3)]
+    status = worker.status()
+    assert status["remaining"] == 0
+    assert status["reencoded"] == 3
+
+    db = session_factory()
+    # The re-encoded references moved from the old gallery to the new one
+    assert read_generation(db, OLD)[2] == 0
+    assert read_generation(db, NEW)[2] == 5
+    db.close()
+
+
+def test_failed_images_are_reported_and_skipped(session_factory, tmp_path):
+    add_images(session_factory, 3, OLD)
+    worker = make_worker(FakeFaceService(missing={"v0-1.jpg"}), session_factory, tmp_path)
+    run(worker)
+    status = worker.status()
+    assert status["failed"] == 1
+    assert status["remaining"] == 0
+    assert len(status["failed_ids"]) == 1
+
+
+def test_pass_resumes_from_the_database(session_factory, tmp_path):
+    add_images(session_factory, 4, OLD)
+    db = session_factory()
+    # A previous pass re-encoded the first two before stopping
+    for image in db.query(Image).order_by(Image.id).limit(2):
+        image.encoding_version = NEW[2]
+    db.commit()
+    db.close()
+    face_service = FakeFaceService()
+    run(make_worker(face_service, session_factory, tmp_path))
+    assert sorted(face_service.encoded) == ["v0-2.jpg", "v0-3.jpg"]
+
+
+def test_only_the_lease_holder_reencodes(session_factory, tmp_path):
+    add_images(session_factory, 2, OLD)
+    holder = Lease("reindex", 60, session_factory)
+    assert holder.acquire()
+    face_service = FakeFaceService()
+    worker = make_worker(face_service, session_factory, tmp_path,
+                         lease=Lease("reindex", 0.2, session_factory))
+    worker.start()
+    worker._thread.join(timeout=0.5)
+    assert worker.running
+    assert not worker.status()["claimed"]
+    assert face_service.encoded == []
+
+    # The holder finishes or crashes; the waiting worker takes over
+    holder.release()
+    worker._thread.join(timeout=30)
+    assert not worker.running
+    assert len(face_service.encoded) == 2
+
+
+def test_lease_expires_and_renews(session_factory):
+    first = Lease("work", 0.1, session_factory)
+    second = Lease("work", 0.1, session_factory)
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+    first.ttl = 0
+    assert first.acquire()
+    assert second.acquire()
+
+
+def test_live_traffic_counts_every_worker_process(tmp_path):
+    traffic = LiveTraffic(str(tmp_path))
+    # Another live worker process with two requests in flight
+    with open(tmp_path / str(os.getppid()), "wb") as f:
+        f.write(struct.pack("<q", 2))
+    # A worker that exited without cleaning up
+    dead = tmp_path / "999999999"
+    dead.write_bytes(struct.pack("<q", 5))
+
+    async def request():
+        tracker = traffic.track()
+        await tracker.__anext__()
+        in_flight = traffic.active
+        with pytest.raises(StopAsyncIteration):
+            await tracker.__anext__()
+        return in_flight
+
+    assert asyncio.run(request()) == 3
+    assert traffic.active == 2
+    assert not dead.exists()
@@ -0,0 +1,82 @@
+import numpy as np
+
+from utils import face_recognition_util, score_stats
+from utils.face_recognition_util import FaceRecognitionService
+from utils.score_stats import GalleryScoreStats, ScoreHistogram, ScoreStatsRegistry
+
+
+def test_histogram_counts_and_clips_out_of_range_scores():
+    histogram = ScoreHistogram(bins=10, low=0.0, high=1.0)
+    histogram.add(np.array([0.05, 0.15, 0.15, -3.0, 7.0]))
+    assert histogram.total == 5
+    assert histogram.counts[0] == 2
+    assert histogram.counts[1] == 2
+    assert histogram.counts[-1] == 1
+
+
+def test_quantile_returns_upper_bin_edge():
+    histogram = ScoreHistogram(bins=100, low=0.0, high=1.0)
+    histogram.add(np.linspace(0.0, 0.999, 1000))
+    assert abs(histogram.quantile(0.5) - 0.5) <= 0.02
+    assert ScoreHistogram().quantile(0.5) is None
+
+
+def test_threshold_for_tail_bounds_fraction_above():
+    histogram = ScoreHistogram(bins=100, low=0.0, high=1.0)
+    scores = np.random.default_rng(0).random(10000)
+    histogram.add(scores)
+    threshold = histogram.threshold_for_tail(0.01)
+    assert np.mean(scores >= threshold) <= 0.01
+    # One bin lower would admit more than the allowed fraction
+    assert np.mean(scores >= threshold - histogram.bin_width) > 0.01
+
+
+def test_threshold_for_tail_with_no_allowance_is_above_all_scores():
+    histogram = ScoreHistogram(bins=10, low=0.0, high=1.0)
+    histogram.add(np.array([0.95]))
+    assert histogram.threshold_for_tail(0.0) == 1.0
+
+
+def test_record_scan_excludes_best_from_impostors():
+    stats = GalleryScoreStats()
+    similarities = np.array([0.1, 0.2, 0.99, 0.3])
+    stats.record_scan(similarities, 0.99, scanned=4, gallery_size=4)
+    assert stats.best.total == 1
+    assert stats.impostor.total == 3
+    assert stats.to_dict(0.9)["average_scanned_fraction"] == 1.0
+
+
+def test_early_exit_threshold_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(score_stats, "EARLY_EXIT_MIN_SAMPLES", 100)
+    stats = GalleryScoreStats()
+    assert stats.early_exit_threshold(0.95) is None
+    stats.record_scan(np.linspace(-0.5, 0.5, 200), 0.5, scanned=200, gallery_size=200)
+    # Impostors all sit below the floor, so the floor wins
+    assert stats.early_exit_threshold(0.95) == 0.95
+
+
+def test_registry_creates_gallery_once():
+    registry = ScoreStatsRegistry()
+    assert registry.get("a") is registry.get("a")
+    assert registry.galleries() == ["a"]
+
+
+def test_early_exit_scans_in_waves_and_stops_after_the_match(monkeypatch):
+    monkeypatch.setattr(face_recognition_util, "MATCH_SCAN_CHUNK", 4)
+    monkeypatch.setattr(face_recognition_util.os, "cpu_count", lambda: 2)
+    rng = np.random.default_rng(0)
+    gallery = [(image_id, rng.random(128)) for image_id in range(40)]
+    query = gallery[13][1]
+    service = FaceRecognitionService()
+    try:
+        similarities, early_exit = service._scan_in_process(query, gallery, True, 0.99)
+        # Chunk 3 holds the match; its wave (chunks 2 and 3) is the last one scanned
+        assert early_exit
+        assert len(similarities) == 16
+        assert int(np.argmax(similarities)) == 13
+
+        full, early_exit = service._scan_in_process(query, gallery, True, None)
+        assert not early_exit
+        assert np.allclose(full[:16], similarities)
+    finally:
+        service.close()
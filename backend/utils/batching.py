@@ -0,0 +1,90 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Groups individually submitted items into micro-batches.
+
+    Callers ``submit`` one item and get a ``Future`` back. A single worker
+    thread collects items until either ``max_batch_size`` is reached or the
+    oldest item has waited ``max_wait`` seconds, hands the batch to
+    ``process_batch`` and resolves each caller's future with its own result.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait: float = 0.02, name: str = "micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self, first: tuple) -> List[tuple]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Shutting down: finish this batch, then let _run exit
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            # One failing batch must never end the only worker thread
+            try:
+                self._process(self._collect(first))
+            except Exception as e:
+                logger.error(f"Unexpected error in {self.name}: {str(e)}")
+
+    def _process(self, batch: List[tuple]):
+        # Drop items whose caller gave up (e.g. a cancelled request awaiting
+        # the future); resolving a cancelled future would raise
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        futures = [future for _, future in batch]
+        try:
+            results = self.process_batch([item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"Error processing batch of {len(batch)} in {self.name}: {str(e)}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def close(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join(timeout=5)
+                self._thread = None
@@ -0,0 +1,253 @@
+import os
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from models.image import Image, MatchResult
+from models.user import User
+from utils.galleries import ensure_galleries, record_change
+from utils.leases import Lease
+from utils.thumbnails import DERIVATIVE_KINDS, DERIVED_DIR, derivative_path
+
+logger = logging.getLogger(__name__)
+
+# Rows deleted per transaction and files examined per garbage collection chunk
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "500"))
+# Threads unlinking files in parallel
+UNLINK_WORKERS = int(os.getenv("UNLINK_WORKERS", "8"))
+# Seconds between background garbage collection passes (0 disables them)
+GC_INTERVAL_SECONDS = float(os.getenv("GC_INTERVAL_SECONDS", "3600"))
+# Files younger than this are never collected: an upload writes its file
+# before the Image row is committed
+GC_MIN_FILE_AGE_SECONDS = float(os.getenv("GC_MIN_FILE_AGE_SECONDS", "3600"))
+
+# Extensions /upload accepts
+UPLOAD_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# Bound parameters per IN query, below SQLite's historical limit of 999
+MAX_QUERY_PARAMETERS = 900
+
+UPLOAD_SUBDIRS = (os.path.join("uploads", "reference"), os.path.join("uploads", "query"))
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _unlink(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.error(f"Error deleting file {path}: {str(e)}")
+        return False
+
+
+class ImageCleaner:
+    """Batched deletion of images with their match results, files and derivatives.
+
+    Rows are deleted before files, so a crash can only leave orphaned files
+    behind, never rows pointing at missing files; the garbage collector picks
+    those up. ``on_deleted(image_ids, removed_reference)`` is called after
+    every committed batch so in-memory indexes and caches can drop exactly
+    those images instead of being rebuilt.
+    """
+
+    def __init__(self, session_factory=SessionLocal,
+                 on_deleted: Optional[Callable[[List[int], bool], None]] = None,
+                 batch_size: int = DELETE_BATCH_SIZE, unlink_workers: int = UNLINK_WORKERS):
+        self.session_factory = session_factory
+        self.on_deleted = on_deleted
+        self.batch_size = batch_size
+        self.unlink_workers = unlink_workers
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def unlink_files(self, paths: List[str]) -> int:
+        """Delete files in parallel, ignoring ones that are already gone."""
+        if not paths:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.unlink_workers) as executor:
+            return sum(executor.map(_unlink, paths))
+
+    def delete_images(self, db: Session, image_ids: List[int]) -> Dict[str, int]:
+        """Delete images, the match results referencing them and their files, in batches."""
+        counts = {"images": 0, "match_results": 0, "files": 0}
+        for chunk in _chunks(list(image_ids), self.batch_size):
+            rows = db.query(
+                Image.id, Image.filename, Image.filepath, Image.is_reference,
+                Image.encoding_model, Image.encoding_detector, Image.encoding_version
+            ).filter(Image.id.in_(chunk)).all()
+            if not rows:
+                continue
+            ids = [row.id for row in rows]
+
+            # Group references by gallery: each gallery's generation is bumped
+            # by the rows actually deleted, so a concurrent deletion of the
+            # same images (another worker's garbage collection) is not counted twice
+            groups: Dict[tuple, List[int]] = {}
+            for row in rows:
+                signature = (row.encoding_model, row.encoding_detector, row.encoding_version) if row.is_reference else None
+                groups.setdefault(signature, []).append(row.id)
+            # Create missing counter rows before this transaction's first write
+            ensure_galleries(db, [signature for signature in groups if signature is not None])
+
+            counts["match_results"] += db.query(MatchResult).filter(or_(
+                MatchResult.source_image_id.in_(ids),
+                MatchResult.matched_image_id.in_(ids)
+            )).delete(synchronize_session=False)
+            for signature, group in groups.items():
+                deleted = db.query(Image).filter(Image.id.in_(group)).delete(synchronize_session=False)
+                counts["images"] += deleted
+                if signature is not None:
+                    record_change(db, signature, removed=deleted)
+            db.commit()
+
+            if self.on_deleted is not None:
+                self.on_deleted(ids, any(row.is_reference for row in rows))
+
+            paths = [row.filepath for row in rows if row.filepath]
+            paths += [derivative_path(kind, row.filename) for row in rows for kind in DERIVATIVE_KINDS]
+            counts["files"] += self.unlink_files(paths)
+        return counts
+
+    def delete_user(self, db: Session, user: User) -> Dict[str, int]:
+        """Delete a user together with all of their images, match results and files."""
+        counts = {"images": 0, "match_results": 0, "files": 0}
+        while True:
+            image_ids = [image_id for (image_id,) in db.query(Image.id).filter(
+                Image.user_id == user.id
+            ).order_by(Image.id).limit(self.batch_size).all()]
+            if not image_ids:
+                break
+            for key, value in self.delete_images(db, image_ids).items():
+                counts[key] += value
+        db.delete(user)
+        db.commit()
+        return counts
+
+    def collect_garbage(self) -> Dict[str, int]:
+        """One garbage collection pass over orphaned rows and files, in bounded chunks."""
+        counts = {"images": 0, "match_results": 0, "files": 0}
+        db = self.session_factory()
+        try:
+            # Images whose owner no longer exists
+            while not self._stop.is_set():
+                orphan_ids = [image_id for (image_id,) in db.query(Image.id).outerjoin(
+                    User, Image.user_id == User.id
+                ).filter(User.id == None).limit(self.batch_size).all()]
+                if not orphan_ids:
+                    break
+                for key, value in self.delete_images(db, orphan_ids).items():
+                    counts[key] += value
+
+            # Match results pointing at images that no longer exist
+            for column in (MatchResult.source_image_id, MatchResult.matched_image_id):
+                while not self._stop.is_set():
+                    orphan_ids = [match_id for (match_id,) in db.query(MatchResult.id).outerjoin(
+                        Image, column == Image.id
+                    ).filter(Image.id == None).limit(self.batch_size).all()]
+                    if not orphan_ids:
+                        break
+                    counts["match_results"] += db.query(MatchResult).filter(
+                        MatchResult.id.in_(orphan_ids)
+                    ).delete(synchronize_session=False)
+                    db.commit()
+
+            # Uploaded files without an Image row
+            for directory in UPLOAD_SUBDIRS:
+                counts["files"] += self._collect_files(db, directory, self._unreferenced_uploads)
+
+            # Derivatives whose original was deleted
+            for kind in DERIVATIVE_KINDS:
+                counts["files"] += self._collect_files(db, os.path.join(DERIVED_DIR, kind), self._unreferenced_derivatives)
+        finally:
+            db.close()
+
+        logger.info(f"Garbage collection removed {counts['images']} images, "
+                    f"{counts['match_results']} match results and {counts['files']} files")
+        return counts
+
+    def _collect_files(self, db: Session, directory: str, find_unreferenced) -> int:
+        if not os.path.isdir(directory):
+            return 0
+        cutoff = time.time() - GC_MIN_FILE_AGE_SECONDS
+        removed = 0
+        chunk = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if self._stop.is_set():
+                    break
+                if not entry.is_file() or entry.stat().st_mtime > cutoff:
+                    continue
+                chunk.append(entry.name)
+                if len(chunk) >= self.batch_size:
+                    removed += self.unlink_files([os.path.join(directory, name) for name in find_unreferenced(db, chunk)])
+                    chunk = []
+        if chunk:
+            removed += self.unlink_files([os.path.join(directory, name) for name in find_unreferenced(db, chunk)])
+        return removed
+
+    @staticmethod
+    def _unreferenced_uploads(db: Session, names: List[str]) -> List[str]:
+        referenced = set()
+        for chunk in _chunks(names, MAX_QUERY_PARAMETERS):
+            referenced.update(filename for (filename,) in db.query(Image.filename).filter(Image.filename.in_(chunk)))
+        return [name for name in names if name not in referenced]
+
+    @staticmethod
+    def _unreferenced_derivatives(db: Session, names: List[str]) -> List[str]:
+        # Derivatives are named after the upload's stem; look the originals up by
+        # exact name for every allowed extension. An original with an unusual
+        # extension case is missed, which only costs regenerating its derivative
+        stems = {os.path.splitext(name)[0]: name for name in names}
+        candidates = [
+            stem + extension
+            for stem in stems
+            for extension in UPLOAD_EXTENSIONS + tuple(ext.upper() for ext in UPLOAD_EXTENSIONS)
+        ]
+        referenced = set()
+        for chunk in _chunks(candidates, MAX_QUERY_PARAMETERS):
+            referenced.update(
+                os.path.splitext(filename)[0]
+                for (filename,) in db.query(Image.filename).filter(Image.filename.in_(chunk))
+            )
+        return [name for stem, name in stems.items() if stem not in referenced]
+
+    def start_background(self, interval: float = GC_INTERVAL_SECONDS):
+        """Run collect_garbage every ``interval`` seconds in a daemon thread.
+
+        Every worker process starts the thread, but a pass only runs in the
+        process holding the "garbage-collection" lease; the holder keeps it
+        by renewing it every pass.
+        """
+        if interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        lease = Lease("garbage-collection", 1.5 * interval, self.session_factory)
+
+        def run():
+            while not self._stop.wait(interval):
+                if not lease.acquire():
+                    continue
+                try:
+                    self.collect_garbage()
+                except Exception as e:
+                    logger.error(f"Garbage collection error: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name="garbage-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
@@ -1,12 +1,15 @@
-import face_recognition
 import numpy as np
-import cv2
 from typing import List, Tuple, Optional, Dict
 import base64
 import os
-from deepface import DeepFace
+import importlib
+import importlib.metadata
+import threading
+import time
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future
+from utils.batching import MicroBatcher
+from utils.score_stats import ScoreStatsRegistry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,19 +18,186 @@ logger = logging.getLogger(__name__)
 # Default similarity threshold (can be configured)
 DEFAULT_SIMILARITY_THRESHOLD = 0.95  # 95% similarity required for a match
 
+# Gallery encodings are scored in chunks of this many rows
+MATCH_SCAN_CHUNK = 4096
+# Stop scanning once a candidate passes the calibrated near-certain threshold
+MATCH_EARLY_EXIT = os.getenv("MATCH_EARLY_EXIT", "false").lower() == "true"
+# Name of the reference gallery in the score statistics
+DEFAULT_GALLERY = "reference"
+
+# Network that produces face_recognition's 128-d encodings
+ENCODING_MODEL = "dlib_face_recognition_resnet_model_v1"
+
+# Micro-batching of CNN face detection (only used when the detector is 'cnn')
+FACE_BATCH_SIZE = int(os.getenv("FACE_BATCH_SIZE", "8"))
+FACE_BATCH_MAX_WAIT_MS = float(os.getenv("FACE_BATCH_MAX_WAIT_MS", "20"))
+# Images are only detected together when the padded canvas is at most this
+# multiple of each image's own area; others go to separate detector calls
+FACE_BATCH_MAX_PADDING = float(os.getenv("FACE_BATCH_MAX_PADDING", "1.5"))
+
+# Heavy recognition backends are imported on first use rather than at module
+# import, so the API can start (and answer /health) before they are loaded
+BACKEND_MODULES = {
+    "face_recognition": "face_recognition",  # dlib and its detector/encoder models
+    "cv2": "cv2",
+    "deepface": "deepface.DeepFace",  # pulls in TensorFlow
+}
+# Backends loaded in the background at startup; /ready waits for these
+PRELOAD_BACKENDS = [
+    name.strip() for name in os.getenv("PRELOAD_BACKENDS", "face_recognition,cv2").split(",") if name.strip()
+]
+
+_backends: Dict[str, object] = {}
+_backends_lock = threading.Lock()
+# Why a preloaded backend failed to import, by name
+_backend_errors: Dict[str, str] = {}
+
+def _package_version(package: str) -> str:
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+# Versions of the packages that determine encoding values, read from package
+# metadata so computing it does not import dlib
+ENCODING_VERSION = ";".join(
+    f"{package}-{_package_version(package)}"
+    for package in ("face_recognition", "face_recognition_models", "dlib")
+)
+
+def load_backend(name: str):
+    """Import a recognition backend on first use and return the module."""
+    module = _backends.get(name)
+    if module is None:
+        with _backends_lock:
+            module = _backends.get(name)
+            if module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(BACKEND_MODULES[name])
+                _backends[name] = module
+                logger.info(f"Loaded {name} backend in {time.perf_counter() - started:.2f}s")
+    return module
+
+def group_by_shape(shapes: List[Tuple[int, int]], max_padding: float = FACE_BATCH_MAX_PADDING) -> List[List[int]]:
+    """
+    Split images into groups that can be zero-padded to a common size cheaply.
+    
+    Args:
+        shapes: (height, width) of each image
+        max_padding: Largest allowed ratio between a group's padded canvas
+            area and the area of any image in it
+        
+    Returns:
+        Lists of indices into shapes, largest images first
+    """
+    remaining = sorted(range(len(shapes)), key=lambda i: shapes[i][0] * shapes[i][1], reverse=True)
+    groups = []
+    while remaining:
+        first = remaining.pop(0)
+        group = [first]
+        height, width = shapes[first]
+        rest = []
+        for index in remaining:
+            candidate_height = max(height, shapes[index][0])
+            candidate_width = max(width, shapes[index][1])
+            # Candidates come in decreasing area, so the newest is the smallest member
+            if candidate_height * candidate_width <= max_padding * shapes[index][0] * shapes[index][1]:
+                group.append(index)
+                height, width = candidate_height, candidate_width
+            else:
+                rest.append(index)
+        groups.append(group)
+        remaining = rest
+    return groups
+
 class FaceRecognitionService:
-    def __init__(self, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    def __init__(self, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD, early_exit=MATCH_EARLY_EXIT):
         self.similarity_threshold = similarity_threshold
+        self.early_exit = early_exit
+        # Best-match and impostor score histograms per gallery
+        self.score_stats = ScoreStatsRegistry()
         self.models = {
             "face_recognition": "hog",  # Can be 'hog' (faster) or 'cnn' (more accurate)
             "deepface": "VGG-Face"  # Options: VGG-Face, Facenet, OpenFace, DeepFace, DeepID, ArcFace, Dlib
         }
+        # Groups concurrent CNN detections into batch_face_locations calls
+        self._face_batcher = MicroBatcher(
+            self._locate_and_encode_batch,
+            max_batch_size=FACE_BATCH_SIZE,
+            max_wait=FACE_BATCH_MAX_WAIT_MS / 1000,
+            name="face-batcher"
+        )
         # Create directory for temporary files if it doesn't exist
         os.makedirs("temp", exist_ok=True)
         
+    def warm_up(self):
+        """Load the preloaded backends; meant to run in a background thread at startup."""
+        for name in PRELOAD_BACKENDS:
+            try:
+                load_backend(name)
+                _backend_errors.pop(name, None)
+            except Exception as e:
+                # Reported by /ready; the backend is retried on first use
+                _backend_errors[name] = f"{type(e).__name__}: {str(e)}"
+                logger.error(f"Error loading {name} backend: {str(e)}")
+    
+    def backend_status(self) -> Dict[str, Dict]:
+        """Whether each preloaded backend is loaded, and why it failed to load if it did."""
+        return {
+            name: {"loaded": name in _backends, "error": None if name in _backends else _backend_errors.get(name)}
+            for name in PRELOAD_BACKENDS
+        }
+    
+    def encoding_signature(self) -> Tuple[str, str, str]:
+        """(model, detector, version) that new encodings are produced with."""
+        return (ENCODING_MODEL, self.models["face_recognition"], ENCODING_VERSION)
+    
     def encode_face(self, image_path: str) -> Optional[np.ndarray]:
         """Extract face encoding from an image."""
+        located = self.locate_and_encode_face(image_path)
+        return located[1] if located is not None else None
+    
+    def locate_and_encode_face(self, image_path: str) -> Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+        """
+        Extract the location and encoding of the first face in an image.
+        
+        Args:
+            image_path: Path to the image
+            
+        Returns:
+            Tuple of (face location as (top, right, bottom, left), face encoding),
+            or None if no face could be encoded
+        """
+        if self._use_batching():
+            return self._face_batcher.submit(image_path).result()
+        return self._locate_and_encode_single(image_path)
+    
+    def submit_locate_and_encode_face(self, image_path: str) -> Future:
+        """
+        Non-blocking variant of locate_and_encode_face.
+        
+        With the CNN detector the image joins the next micro-batch; otherwise
+        it is processed immediately and an already completed future returned.
+        Async callers can await the result with asyncio.wrap_future.
+        """
+        if self._use_batching():
+            return self._face_batcher.submit(image_path)
+        future = Future()
+        future.set_result(self._locate_and_encode_single(image_path))
+        return future
+    
+    def locate_and_encode_faces(self, image_paths: List[str]) -> List[Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]]:
+        """Bulk variant of locate_and_encode_face; results are in input order."""
+        futures = [self.submit_locate_and_encode_face(image_path) for image_path in image_paths]
+        return [future.result() for future in futures]
+    
+    def _use_batching(self) -> bool:
+        # dlib only has a batched detector for the CNN model
+        return self.models["face_recognition"] == "cnn" and FACE_BATCH_SIZE > 1
+    
+    def _locate_and_encode_single(self, image_path: str) -> Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]:
         try:
+            face_recognition = load_backend("face_recognition")
             # Load image
             image = face_recognition.load_image_file(image_path)
             
@@ -40,18 +210,96 @@ class FaceRecognitionService:
                 return None
                 
             # Get face encodings (using the first face found)
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            face_encodings = face_recognition.face_encodings(image, face_locations[:1])
             
             if not face_encodings:
                 logger.warning(f"Could not encode face in image: {image_path}")
                 return None
                 
-            # Return the first face encoding
-            return face_encodings[0]
+            # Return the first face and its encoding
+            return face_locations[0], face_encodings[0]
         except Exception as e:
             logger.error(f"Error encoding face: {str(e)}")
             return None
     
+    def _locate_and_encode_batch(self, image_paths: List[str]) -> List[Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]]:
+        """
+        Run the CNN detector over a micro-batch of images in one call.
+        
+        batch_face_locations needs equally sized images, so images of similar
+        shape are grouped (see group_by_shape) and each is zero-padded at the
+        bottom/right to the largest size in its group; detections are trimmed
+        back to the original bounds. An image unlike any other is detected on
+        its own, so one large photo does not make the whole batch expensive.
+        """
+        results: List[Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]] = [None] * len(image_paths)
+        try:
+            face_recognition = load_backend("face_recognition")
+        except Exception as e:
+            logger.error(f"Error loading face_recognition backend: {str(e)}")
+            return results
+        
+        loaded = []
+        for index, image_path in enumerate(image_paths):
+            try:
+                loaded.append((index, face_recognition.load_image_file(image_path)))
+            except Exception as e:
+                logger.error(f"Error loading image {image_path}: {str(e)}")
+        if not loaded:
+            return results
+        
+        batch_locations = [None] * len(loaded)
+        for group in group_by_shape([image.shape[:2] for _, image in loaded]):
+            images = [loaded[position][1] for position in group]
+            try:
+                if len(images) == 1:
+                    group_locations = [face_recognition.face_locations(
+                        images[0], number_of_times_to_upsample=1, model="cnn"
+                    )]
+                else:
+                    height = max(image.shape[0] for image in images)
+                    width = max(image.shape[1] for image in images)
+                    padded = []
+                    for image in images:
+                        canvas = np.zeros((height, width, 3), dtype=image.dtype)
+                        canvas[:image.shape[0], :image.shape[1]] = image
+                        padded.append(canvas)
+                    group_locations = face_recognition.batch_face_locations(
+                        padded, number_of_times_to_upsample=1, batch_size=len(padded)
+                    )
+            except Exception as e:
+                logger.error(f"Error detecting faces in batch of {len(images)}: {str(e)}")
+                continue
+            for position, face_locations in zip(group, group_locations):
+                batch_locations[position] = face_locations
+        
+        for (index, image), face_locations in zip(loaded, batch_locations):
+            if face_locations is None:
+                # Detection failed for the image's group
+                continue
+            image_path = image_paths[index]
+            image_height, image_width = image.shape[:2]
+            # Trim to the unpadded image and drop boxes that lie in the padding
+            face_locations = [
+                (max(top, 0), min(right, image_width), min(bottom, image_height), max(left, 0))
+                for top, right, bottom, left in face_locations
+                if top < image_height and left < image_width
+            ]
+            if not face_locations:
+                logger.warning(f"No faces found in image: {image_path}")
+                continue
+            try:
+                face_encodings = face_recognition.face_encodings(image, face_locations[:1])
+            except Exception as e:
+                logger.error(f"Error encoding face: {str(e)}")
+                continue
+            if not face_encodings:
+                logger.warning(f"Could not encode face in image: {image_path}")
+                continue
+            results[index] = (face_locations[0], face_encodings[0])
+        
+        return results
+    
     def encode_to_base64(self, encoding: np.ndarray) -> str:
         """Convert numpy array to base64 string for storage."""
         return base64.b64encode(encoding.tobytes()).decode('utf-8')
@@ -63,8 +311,9 @@ class FaceRecognitionService:
     
     def compare_faces(self, face_encoding1: np.ndarray, face_encoding2: np.ndarray) -> float:
         """Compare two face encodings and return similarity score."""
-        # Calculate face distance (lower means more similar)
-        face_distance = face_recognition.face_distance([face_encoding1], face_encoding2)[0]
+        # Calculate face distance (lower means more similar); same computation as
+        # face_recognition.face_distance without importing dlib just to match
+        face_distance = np.linalg.norm(face_encoding1 - face_encoding2)
         
         # Convert distance to similarity score (0 to 1, where 1 is perfect match)
         similarity = 1 - face_distance
@@ -77,7 +326,8 @@ class FaceRecognitionService:
     
     def find_match_in_database(self, query_encoding: np.ndarray, 
                               database_encodings: List[Tuple[int, np.ndarray]],
-                              parallel: bool = True) -> Optional[Dict]:
+                              parallel: bool = True, gallery: str = DEFAULT_GALLERY,
+                              record_stats: bool = True) -> Optional[Dict]:
         """
         Find the best match for a face in the database.
         
@@ -85,40 +335,104 @@ class FaceRecognitionService:
             query_encoding: Face encoding to match
             database_encodings: List of tuples (image_id, face_encoding)
             parallel: Whether to use parallel processing
+            gallery: Name of the gallery, used to keep its score statistics apart
+            record_stats: Whether to record the scan in the gallery's score statistics;
+                pass False when matching only a subset, whose best score is no best-match score
             
         Returns:
             Dictionary with match information or None if no match found
         """
         if not database_encodings:
             return None
-            
-        if parallel and len(database_encodings) > 5:
-            # Use parallel processing for larger databases
-            with ThreadPoolExecutor() as executor:
-                results = list(executor.map(
-                    lambda x: (x[0], self.compare_faces(query_encoding, x[1])),
-                    database_encodings
-                ))
-        else:
-            # Sequential processing for smaller databases
-            results = [(id, self.compare_faces(query_encoding, enc)) for id, enc in database_encodings]
         
-        # Sort by similarity score (highest first)
-        results.sort(key=lambda x: x[1], reverse=True)
+        stats = self.score_stats.get(gallery)
+        early_exit_threshold = None
+        if self.early_exit:
+            early_exit_threshold = stats.early_exit_threshold(self.similarity_threshold)
+        similarities, early_exit = self._scan_in_process(
+            query_encoding, database_encodings, parallel, early_exit_threshold
+        )
+        best_index = int(np.argmax(similarities))
+        best_match_id = database_encodings[best_index][0]
+        best_similarity = float(similarities[best_index])
+        if record_stats:
+            stats.record_scan(similarities, best_similarity, len(similarities), len(database_encodings), early_exit)
         
-        # Get the best match
-        best_match_id, best_similarity = results[0]
+        return self._match_or_none(best_match_id, best_similarity)
+    
+    def best_candidate(self, candidates: List[Tuple[int, float]], gallery_size: int,
+                       gallery: str = DEFAULT_GALLERY) -> Optional[Dict]:
+        """
+        Pick the match among candidates found by a sharded gallery index.
         
+        Args:
+            candidates: List of tuples (image_id, similarity)
+            gallery_size: Number of references the index searched
+            gallery: Name of the gallery, used to keep its score statistics apart
+            
+        Returns:
+            Dictionary with match information or None if no match found
+        """
+        if not candidates:
+            return None
+        best_match_id, best_similarity = max(candidates, key=lambda x: x[1])
+        # Shards only return their top candidates, so only the best score is recorded
+        self.score_stats.get(gallery).record_scan(None, best_similarity, gallery_size, gallery_size)
+        return self._match_or_none(best_match_id, best_similarity)
+    
+    def _match_or_none(self, image_id: int, similarity: float) -> Optional[Dict]:
         # Check if it's a match
-        if self.is_match(best_similarity):
+        if self.is_match(similarity):
             return {
-                "image_id": best_match_id,
-                "similarity": best_similarity,
+                "image_id": image_id,
+                "similarity": similarity,
                 "is_match": True
             }
         
         return None
     
+    def _scan_in_process(self, query_encoding: np.ndarray,
+                         database_encodings: List[Tuple[int, np.ndarray]],
+                         parallel: bool, early_exit_threshold: Optional[float]) -> Tuple[np.ndarray, bool]:
+        """
+        Compute similarities chunk by chunk.
+        
+        Returns:
+            Tuple of (similarities of the scanned prefix of the gallery, whether
+            the scan stopped early because a candidate reached early_exit_threshold)
+        """
+        def score_chunk(start: int) -> np.ndarray:
+            chunk = np.vstack([enc for _, enc in database_encodings[start:start + MATCH_SCAN_CHUNK]])
+            # Same computation as compare_faces, vectorized over the chunk
+            return 1 - np.linalg.norm(chunk - query_encoding, axis=1)
+        
+        starts = range(0, len(database_encodings), MATCH_SCAN_CHUNK)
+        
+        if early_exit_threshold is not None:
+            # Score a wave of chunks concurrently, then stop if the wave found
+            # a near-certain match; at most one wave is scanned past it
+            wave = (os.cpu_count() or 1) if parallel else 1
+            parts = []
+            with ThreadPoolExecutor(max_workers=wave) as executor:
+                for first in range(0, len(starts), wave):
+                    wave_starts = starts[first:first + wave]
+                    parts.extend(executor.map(score_chunk, wave_starts))
+                    if max(part.max() for part in parts[-len(wave_starts):]) >= early_exit_threshold:
+                        scanned = wave_starts[-1] + MATCH_SCAN_CHUNK
+                        return np.concatenate(parts), scanned < len(database_encodings)
+        elif parallel and len(starts) > 1:
+            # numpy releases the GIL, so chunks are scored concurrently
+            with ThreadPoolExecutor() as executor:
+                parts = list(executor.map(score_chunk, starts))
+        else:
+            parts = [score_chunk(start) for start in starts]
+        
+        return np.concatenate(parts), False
+    
+    def close(self):
+        """Stop the face batcher."""
+        self._face_batcher.close()
+    
     def verify_with_deepface(self, img1_path: str, img2_path: str) -> Dict:
         """
         Secondary verification using DeepFace for higher accuracy.
@@ -131,6 +445,7 @@ class FaceRecognitionService:
             Dictionary with verification results
         """
         try:
+            DeepFace = load_backend("deepface")
             result = DeepFace.verify(
                 img1_path=img1_path,
                 img2_path=img2_path,
@@ -153,6 +468,8 @@ class FaceRecognitionService:
             List of dictionaries with face information
         """
         try:
+            cv2 = load_backend("cv2")
+            face_recognition = load_backend("face_recognition")
             # Load image
             image = cv2.imread(image_path)
             if image is None:
@@ -198,6 +515,7 @@ class FaceRecognitionService:
             Dictionary with analysis results
         """
         try:
+            DeepFace = load_backend("deepface")
             analysis = DeepFace.analyze(
                 img_path=image_path,
                 actions=['age', 'gender', 'race', 'emotion'],
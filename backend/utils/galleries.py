@@ -0,0 +1,70 @@
+from typing import Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.image import Image, ReferenceGallery
+
+
+def gallery_key(signature: tuple) -> str:
+    """Stable name of the reference gallery for an encoding signature."""
+    return "/".join(str(part) for part in signature)
+
+
+def ensure_galleries(db: Session, signatures) -> None:
+    """Create missing counter rows, counting the references that already exist.
+
+    Runs in its own transaction so it never commits or rolls back the caller's
+    work. Call it before the caller's first write: on SQLite a second
+    connection cannot write while the caller's transaction holds the lock.
+    """
+    for signature in signatures:
+        key = gallery_key(signature)
+        if db.get(ReferenceGallery, key) is not None:
+            continue
+        with Session(bind=db.get_bind()) as setup:
+            count = setup.query(func.count(Image.id)).filter(
+                Image.is_reference == True,
+                Image.with_encoding_signature(signature)
+            ).scalar()
+            setup.add(ReferenceGallery(signature=key, epoch=0, additions=0, reference_count=count))
+            try:
+                setup.commit()
+            except IntegrityError:
+                # Another request or worker created it first
+                setup.rollback()
+
+
+def read_generation(db: Session, signature: tuple) -> Tuple[int, int, int]:
+    """Return (epoch, additions, reference count) of a gallery with one primary key lookup."""
+    key = gallery_key(signature)
+    gallery = db.get(ReferenceGallery, key, populate_existing=True)
+    if gallery is None:
+        ensure_galleries(db, [signature])
+        gallery = db.get(ReferenceGallery, key)
+    return gallery.epoch, gallery.additions, gallery.reference_count
+
+
+def record_change(db: Session, signature: tuple, added: int = 0, removed: int = 0, invalidate: bool = False):
+    """
+    Record a change to a gallery in the caller's transaction; the caller commits.
+
+    Args:
+        db: Session holding the change
+        signature: Encoding signature of the gallery
+        added: References added; additions only allow an incremental rescan
+            when the new references have the highest ids
+        removed: References removed; bumps the epoch
+        invalidate: Bump the epoch even without removals (e.g. re-encoded
+            references joining the gallery under older ids)
+    """
+    if not added and not removed and not invalidate:
+        return
+    ensure_galleries(db, [signature])
+    epoch_step = 1 if removed or invalidate else 0
+    db.query(ReferenceGallery).filter(ReferenceGallery.signature == gallery_key(signature)).update({
+        ReferenceGallery.epoch: ReferenceGallery.epoch + epoch_step,
+        ReferenceGallery.additions: ReferenceGallery.additions + added,
+        ReferenceGallery.reference_count: ReferenceGallery.reference_count + added - removed,
+    }, synchronize_session=False)
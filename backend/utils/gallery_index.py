@@ -0,0 +1,316 @@
+import os
+import logging
+import random
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from models.image import Image
+from utils.galleries import read_generation
+from utils.match_engine import ShardedMatchEngine
+from utils.quantization import create_quantizer, TRAINING_SAMPLE
+
+logger = logging.getLogger(__name__)
+
+# Sharded multi-process matching (0 disables it)
+MATCH_SHARDS = int(os.getenv("MATCH_SHARDS", "0"))
+# Galleries smaller than this are scanned in-process; spreading them across
+# shards costs more in IPC than it saves
+MATCH_SHARD_MIN_GALLERY = int(os.getenv("MATCH_SHARD_MIN_GALLERY", "50000"))
+# Compressed gallery representation held by the shards: none, float16, int8 or pq
+MATCH_QUANTIZATION = os.getenv("MATCH_QUANTIZATION", "none")
+# Number of approximate candidates re-ranked with exact float distances
+MATCH_RERANK = int(os.getenv("MATCH_RERANK", "32"))
+# Sharded engines kept alive at once (one per encoding signature during a reindex)
+MATCH_ENGINE_GALLERIES = 2
+
+# References read per query while building or resyncing an index
+INDEX_LOAD_BATCH = 10000
+
+
+def _reference_query(db: Session, signature: tuple, *columns):
+    return db.query(*columns).filter(
+        Image.is_reference == True,
+        Image.with_encoding_signature(signature)
+    )
+
+
+class _GalleryIndex:
+    """A sharded engine plus the gallery generation it is known to hold."""
+
+    def __init__(self, signature: tuple, engine: ShardedMatchEngine, generation: Tuple[int, int, int],
+                 max_id: int):
+        self.signature = signature
+        self.engine = engine
+        # (epoch, additions, reference count) the engine matched when last checked
+        self.generation = generation
+        # Highest id read from the database; later additions have higher ids
+        self.scanned_id = max_id
+        # Highest id held, including uploads added through the hook
+        self.max_id = max_id
+        # Held while catching up or resyncing; searches never wait for it
+        self.lock = threading.Lock()
+
+
+class GalleryIndexes:
+    """Sharded match engines for the large reference galleries, one per encoding signature.
+
+    Engines are built from the database in a background thread, and requests
+    scan in-process until the build is done, so a request never waits for
+    millions of rows to be loaded. Afterwards an index is kept current from
+    the gallery generation (see ``utils.galleries``):
+
+    - uploads handled by this process are added through ``add``, and
+      references committed by other workers are picked up with one indexed
+      ``id >`` query, as long as the epoch is unchanged
+    - deletions handled by this process are applied through ``remove``
+    - an epoch change (a deletion or re-encode, possibly in another worker)
+      or a count that does not add up triggers a background resync that
+      diffs the gallery's ids and loads only the missing encodings
+
+    While an index is out of date ``search`` returns None and the caller
+    scans in-process, so results are never computed over a stale gallery.
+    """
+
+    def __init__(self, decode: Callable[[str], np.ndarray], session_factory=SessionLocal,
+                 num_shards: int = MATCH_SHARDS, quantization: str = MATCH_QUANTIZATION,
+                 rerank: int = MATCH_RERANK, min_gallery: int = MATCH_SHARD_MIN_GALLERY,
+                 max_galleries: int = MATCH_ENGINE_GALLERIES):
+        self.decode = decode
+        self.session_factory = session_factory
+        self.num_shards = num_shards
+        self.quantization = quantization
+        self.rerank = rerank
+        self.min_gallery = min_gallery
+        self.max_galleries = max_galleries
+        # Ready indexes, most recently used last
+        self._indexes: "OrderedDict[tuple, _GalleryIndex]" = OrderedDict()
+        # Signatures with a build or resync thread running
+        self._pending: Dict[tuple, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.num_shards > 0
+
+    def warm(self, signature: tuple):
+        """Start building the gallery's index in the background if it is large enough."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if signature in self._indexes:
+                return
+        self._start(signature, self._build)
+
+    def search(self, db: Session, signature: tuple, generation: tuple,
+               query_encoding: np.ndarray) -> Optional[Tuple[List[Tuple[int, float]], int]]:
+        """
+        Find the best candidates in the gallery's sharded index.
+
+        Args:
+            db: Session used to catch up with new references and to load the
+                shortlist's float encodings
+            signature: Encoding signature of the gallery
+            generation: Gallery generation read before this call, as returned by
+                MatchResultCache.gallery_generation
+            query_encoding: Face encoding to match
+
+        Returns:
+            Tuple of (candidates as (image_id, similarity), highest reference id
+            searched), or None if the gallery has to be scanned in-process
+            because it is small, its index is still being built or out of date
+        """
+        if not self.enabled or generation[2] < self.min_gallery:
+            return None
+        with self._lock:
+            index = self._indexes.get(signature)
+            if index is not None:
+                self._indexes.move_to_end(signature)
+        if index is None:
+            self._start(signature, self._build)
+            return None
+        if not self._catch_up(db, index, generation[:3]):
+            self._start(signature, self._resync)
+            return None
+
+        engine = index.engine
+        try:
+            if engine.quantizer is None:
+                candidates = [(image_id, 1 - distance) for image_id, distance in engine.search(query_encoding, k=1)]
+            else:
+                # Compressed distances are approximate: re-rank the shortlist
+                # exactly, loading the float encodings of just those ids
+                shortlist = [image_id for image_id, _ in engine.search(query_encoding, k=self.rerank)]
+                rows = db.query(Image.id, Image.face_encoding).filter(Image.id.in_(shortlist)).all()
+                candidates = [
+                    (image_id, float(1 - np.linalg.norm(self.decode(face_encoding) - query_encoding)))
+                    for image_id, face_encoding in rows
+                ]
+        except Exception as e:
+            logger.error(f"Error in sharded match, scanning in-process: {str(e)}")
+            if engine.broken:
+                # Stop it so the next match starts a fresh build
+                self._drop(index)
+            return None
+        return candidates, index.max_id
+
+    def add(self, signature: tuple, image_id: int, encoding: np.ndarray):
+        """Add a committed reference to the gallery's index, if it has one."""
+        with self._lock:
+            index = self._indexes.get(signature)
+        if index is None:
+            return
+        try:
+            index.engine.add([(image_id, encoding)])
+            index.max_id = max(index.max_id, image_id)
+        except Exception as e:
+            # The next match notices the missing reference and resyncs
+            logger.error(f"Error adding image to match index: {str(e)}")
+
+    def remove(self, image_ids: List[int]):
+        """Drop deleted images from every index without rebuilding it."""
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            try:
+                index.engine.remove(image_ids)
+            except Exception as e:
+                # The next match notices the stale engine and rebuilds it
+                logger.error(f"Error removing images from match index: {str(e)}")
+
+    def close(self):
+        """Stop the shard processes of every index."""
+        with self._lock:
+            self._closed = True
+            indexes = list(self._indexes.values())
+            self._indexes.clear()
+        for index in indexes:
+            index.engine.close()
+
+    def _catch_up(self, db: Session, index: _GalleryIndex, generation: Tuple[int, int, int]) -> bool:
+        """Bring an index up to the given generation if only references were added."""
+        if index.generation == generation:
+            return True
+        if index.generation[0] != generation[0] or index.engine.broken:
+            return False
+        if not index.lock.acquire(blocking=False):
+            # A resync or another request is updating it
+            return False
+        try:
+            if index.generation == generation:
+                return True
+            rows = _reference_query(db, index.signature, Image.id, Image.face_encoding).filter(
+                Image.id > index.scanned_id
+            ).all()
+            index.engine.add([
+                (image_id, self.decode(face_encoding))
+                for image_id, face_encoding in rows if image_id not in index.engine
+            ])
+            if rows:
+                index.scanned_id = max(image_id for image_id, _ in rows)
+                index.max_id = max(index.max_id, index.scanned_id)
+            # A reference committed out of id order shows up as a count mismatch
+            if len(index.engine) != generation[2]:
+                return False
+            index.generation = generation
+            return True
+        finally:
+            index.lock.release()
+
+    def _start(self, signature: tuple, target: Callable[[tuple], None]):
+        with self._lock:
+            if self._closed or signature in self._pending:
+                return
+            thread = threading.Thread(target=self._run, args=(signature, target),
+                                      name="gallery-index", daemon=True)
+            self._pending[signature] = thread
+        thread.start()
+
+    def _run(self, signature: tuple, target: Callable[[tuple], None]):
+        try:
+            target(signature)
+        except Exception as e:
+            logger.error(f"Error updating match index for {signature}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.pop(signature, None)
+
+    def _load(self, db: Session, image_ids: List[int]) -> List[Tuple[int, np.ndarray]]:
+        items = []
+        for start in range(0, len(image_ids), INDEX_LOAD_BATCH):
+            rows = db.query(Image.id, Image.face_encoding).filter(
+                Image.id.in_(image_ids[start:start + INDEX_LOAD_BATCH])
+            ).all()
+            items.extend((image_id, self.decode(face_encoding)) for image_id, face_encoding in rows)
+        return items
+
+    def _build(self, signature: tuple):
+        db = self.session_factory()
+        engine = None
+        try:
+            # Read the generation first: references committed while loading
+            # only make the first catch-up fail and resync
+            generation = read_generation(db, signature)
+            if generation[2] < self.min_gallery:
+                return
+            ids = [image_id for (image_id,) in _reference_query(db, signature, Image.id).order_by(Image.id)]
+            quantizer = create_quantizer(self.quantization)
+            if quantizer is not None:
+                # Train on a sample of the current gallery
+                sample = random.sample(ids, min(len(ids), TRAINING_SAMPLE))
+                quantizer.fit(np.vstack([encoding for _, encoding in self._load(db, sample)]))
+            engine = ShardedMatchEngine(self.num_shards, quantizer=quantizer)
+            for start in range(0, len(ids), INDEX_LOAD_BATCH):
+                engine.add(self._load(db, ids[start:start + INDEX_LOAD_BATCH]))
+            index = _GalleryIndex(signature, engine, generation, ids[-1] if ids else 0)
+            logger.info(f"Built match index for {signature} with {len(engine)} references")
+        except Exception:
+            if engine is not None:
+                engine.close()
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            if self._closed:
+                stale = [index]
+            else:
+                self._indexes[signature] = index
+                # Stop the least recently used engines (e.g. the old encoding version after a reindex)
+                stale = []
+                while len(self._indexes) > self.max_galleries:
+                    stale.append(self._indexes.popitem(last=False)[1])
+        for old in stale:
+            old.engine.close()
+
+    def _resync(self, signature: tuple):
+        with self._lock:
+            index = self._indexes.get(signature)
+        if index is None:
+            return
+        if index.engine.broken:
+            self._drop(index)
+            return
+        db = self.session_factory()
+        try:
+            with index.lock:
+                generation = read_generation(db, signature)
+                ids = [image_id for (image_id,) in _reference_query(db, signature, Image.id)]
+                removed, added = index.engine.sync(ids, lambda missing: self._load(db, missing))
+                index.scanned_id = max(ids, default=0)
+                index.max_id = index.scanned_id
+                index.generation = generation
+            logger.info(f"Resynced match index for {signature}: {removed} removed, {added} added")
+        finally:
+            db.close()
+
+    def _drop(self, index: _GalleryIndex):
+        with self._lock:
+            if self._indexes.get(index.signature) is index:
+                del self._indexes[index.signature]
+        index.engine.close()
@@ -0,0 +1,73 @@
+import os
+import logging
+import socket
+import time
+import uuid
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from models.lease import BackgroundLease
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    """Cross-process claim on background work, held in the background_leases table.
+
+    With several worker processes (uvicorn --workers, or several hosts sharing
+    the database) every process starts the same background threads; only the
+    holder of the lease does the work. The holder renews it before every unit
+    of work, so a crashed holder is replaced once ``ttl`` seconds have passed.
+    Claiming is a single conditional UPDATE, which the database serializes.
+    """
+
+    def __init__(self, name: str, ttl: float, session_factory=SessionLocal):
+        self.name = name
+        self.ttl = ttl
+        self.session_factory = session_factory
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self) -> bool:
+        """Claim or renew the lease; returns False while another process holds it."""
+        db = self.session_factory()
+        try:
+            if db.get(BackgroundLease, self.name) is None:
+                db.add(BackgroundLease(name=self.name, owner=None, expires_at=0))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Another process created it first
+                    db.rollback()
+            now = time.time()
+            claimed = db.query(BackgroundLease).filter(
+                BackgroundLease.name == self.name,
+                or_(BackgroundLease.owner == self.owner, BackgroundLease.expires_at < now)
+            ).update({
+                BackgroundLease.owner: self.owner,
+                BackgroundLease.expires_at: now + self.ttl,
+            }, synchronize_session=False)
+            db.commit()
+            return claimed == 1
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error claiming {self.name} lease: {str(e)}")
+            return False
+        finally:
+            db.close()
+
+    def release(self):
+        """Give the lease up early if this process holds it."""
+        db = self.session_factory()
+        try:
+            db.query(BackgroundLease).filter(
+                BackgroundLease.name == self.name,
+                BackgroundLease.owner == self.owner
+            ).update({BackgroundLease.expires_at: 0}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error releasing {self.name} lease: {str(e)}")
+        finally:
+            db.close()
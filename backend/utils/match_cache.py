@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from utils.galleries import read_generation
+
+# Maximum number of query images whose match result is kept
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "10000"))
+# Rescan only the references added since a cached result instead of the whole gallery
+MATCH_CACHE_INCREMENTAL = os.getenv("MATCH_CACHE_INCREMENTAL", "true").lower() == "true"
+
+
+class CachedMatch:
+    """Outcome of matching one query image against one gallery generation."""
+
+    __slots__ = ("generation", "max_reference_id", "matched_image_id", "similarity", "match_result_id")
+
+    def __init__(self, generation: tuple, max_reference_id: Optional[int] = None,
+                 matched_image_id: Optional[int] = None, similarity: Optional[float] = None,
+                 match_result_id: Optional[int] = None):
+        self.generation = generation
+        # Highest reference id the result was computed over; later additions
+        # are exactly the references with a higher id
+        self.max_reference_id = max_reference_id
+        # All three are None when the query had no match above the threshold
+        self.matched_image_id = matched_image_id
+        self.similarity = similarity
+        self.match_result_id = match_result_id
+
+
+class MatchResultCache:
+    """LRU cache of /match results keyed by query image id.
+
+    Each entry remembers the gallery generation it was computed against:
+    (epoch, additions, reference count, encoding signature). The counters live
+    in the reference_galleries table and are bumped in the same transaction as
+    every upload, deletion and re-encode, so a change made through any worker
+    process invalidates the entries of all of them, and checking an entry costs
+    one primary key lookup.
+
+    The generation must be read before the references are queried; a change
+    committed in between then shows up as a stale generation on the next call
+    rather than being missed.
+    """
+
+    def __init__(self, max_size: int = MATCH_CACHE_SIZE, incremental: bool = MATCH_CACHE_INCREMENTAL):
+        self.max_size = max_size
+        self.incremental = incremental
+        self._entries: "OrderedDict[int, CachedMatch]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def gallery_generation(db: Session, signature: tuple) -> Tuple[int, int, int, tuple]:
+        """Return (epoch, additions, reference count, encoding signature) of a reference gallery."""
+        return read_generation(db, signature) + (signature,)
+
+    def get(self, image_id: int) -> Optional[CachedMatch]:
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is not None:
+                self._entries.move_to_end(image_id)
+            return entry
+
+    def put(self, image_id: int, entry: CachedMatch):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[image_id] = entry
+            self._entries.move_to_end(image_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, image_id: int):
+        with self._lock:
+            self._entries.pop(image_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
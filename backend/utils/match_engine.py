@@ -0,0 +1,338 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Dimensionality of the dlib face encodings produced by face_recognition
+ENCODING_DIM = 128
+
+# Shards are rebalanced when the largest and smallest differ by more than this
+# fraction of the mean shard size
+REBALANCE_TOLERANCE = 0.1
+
+
+class _ShardStore:
+    """In-process storage for one shard of the reference gallery.
+
+    Lives inside a worker process. Rows are kept in a contiguous buffer that
+    grows geometrically; deletes swap the last row into the freed slot so the
+    buffer never has holes and a scan is a single vectorized pass. With a
+    quantizer the buffer holds compressed codes instead of float64 encodings.
+    """
+
+    def __init__(self, dim: int = ENCODING_DIM, quantizer=None):
+        self.dim = dim
+        self.quantizer = quantizer
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        if quantizer is None:
+            self.code_shape, code_dtype = (dim,), np.float64
+        else:
+            self.code_shape, code_dtype = quantizer.code_shape(dim), quantizer.code_dtype
+        self.encodings = np.empty((0,) + self.code_shape, dtype=code_dtype)
+        self.rows: Dict[int, int] = {}
+
+    def _reserve(self, capacity: int):
+        if capacity <= len(self.ids):
+            return
+        new_capacity = max(capacity, 2 * len(self.ids), 1024)
+        ids = np.empty(new_capacity, dtype=np.int64)
+        encodings = np.empty((new_capacity,) + self.code_shape, dtype=self.encodings.dtype)
+        ids[:self.size] = self.ids[:self.size]
+        encodings[:self.size] = self.encodings[:self.size]
+        self.ids, self.encodings = ids, encodings
+
+    def encode(self, encodings: np.ndarray) -> np.ndarray:
+        if self.quantizer is None:
+            return encodings
+        return self.quantizer.encode(encodings)
+
+    def add(self, ids: np.ndarray, codes: np.ndarray):
+        self._reserve(self.size + len(ids))
+        for image_id, code in zip(ids.tolist(), codes):
+            row = self.rows.get(image_id)
+            if row is None:
+                row = self.size
+                self.size += 1
+                self.rows[image_id] = row
+                self.ids[row] = image_id
+            self.encodings[row] = code
+
+    def remove(self, ids: Iterable[int]) -> int:
+        removed = 0
+        for image_id in ids:
+            row = self.rows.pop(int(image_id), None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                moved_id = int(self.ids[last])
+                self.ids[row] = moved_id
+                self.encodings[row] = self.encodings[last]
+                self.rows[moved_id] = row
+            self.size -= 1
+            removed += 1
+        return removed
+
+    def pop(self, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Remove and return the last ``count`` rows as codes (used for rebalancing)."""
+        count = min(count, self.size)
+        start = self.size - count
+        ids = self.ids[start:self.size].copy()
+        encodings = self.encodings[start:self.size].copy()
+        for image_id in ids.tolist():
+            del self.rows[image_id]
+        self.size = start
+        return ids, encodings
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        if self.size == 0:
+            return []
+        if self.quantizer is None:
+            distances = np.linalg.norm(self.encodings[:self.size] - query, axis=1)
+        else:
+            distances = self.quantizer.distances(query, self.encodings[:self.size])
+        k = min(k, self.size)
+        if k < self.size:
+            candidates = np.argpartition(distances, k - 1)[:k]
+        else:
+            candidates = np.arange(self.size)
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        return [(float(distances[i]), int(self.ids[i])) for i in candidates]
+
+
+def _shard_worker(conn, dim: int, quantizer):
+    """Command loop of a long-lived shard process."""
+    store = _ShardStore(dim, quantizer)
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            break
+        try:
+            if command == "search":
+                query, k = payload
+                conn.send(("ok", store.search(query, k)))
+            elif command == "add":
+                ids, encodings = payload
+                store.add(ids, store.encode(encodings))
+                conn.send(("ok", store.size))
+            elif command == "add_codes":
+                store.add(*payload)
+                conn.send(("ok", store.size))
+            elif command == "remove":
+                store.remove(payload)
+                conn.send(("ok", store.size))
+            elif command == "pop":
+                conn.send(("ok", store.pop(payload)))
+            elif command == "stop":
+                conn.send(("ok", None))
+                break
+            else:
+                conn.send(("error", f"Unknown command: {command}"))
+        except Exception as e:  # Keep the shard alive; report to the caller
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+class ShardedMatchEngine:
+    """Reference gallery split across long-lived worker processes.
+
+    Each shard holds a disjoint slice of the gallery in its own process so a
+    query is scanned by all cores at once. Queries are fanned out to every
+    shard and the per-shard top-k lists are combined with a k-way merge.
+    New encodings are routed to the smallest shards and shards are rebalanced
+    after deletes so no single worker becomes the straggler.
+
+    An optional trained quantizer (see ``utils.quantization``) makes the shards
+    keep compressed codes; ``search`` then returns approximate distances and
+    callers are expected to re-rank the candidates exactly.
+
+    Image ids are treated as immutable: ``sync`` ships only added and removed
+    ids, never a changed encoding under an existing id. Galleries are keyed by
+    encoding signature, so re-encoded images move to another engine instead.
+
+    If a shard fails or dies, the engine is marked ``broken`` and every later
+    call raises; callers should close it and build a new one.
+    """
+
+    def __init__(self, num_shards: int, dim: int = ENCODING_DIM, quantizer=None):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.dim = dim
+        self.quantizer = quantizer
+        # Reentrant so sync can hold it across its diff, add and remove
+        self._lock = threading.RLock()
+        # Spawn rather than fork: the API process runs threads (uvicorn,
+        # ThreadPoolExecutor) which are unsafe to fork
+        context = multiprocessing.get_context("spawn")
+        self._conns = []
+        self._processes = []
+        for _ in range(num_shards):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_conn, dim, quantizer), daemon=True)
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        self._sizes = [0] * num_shards
+        # image_id -> shard index
+        self._locations: Dict[int, int] = {}
+        self.broken = False
+        logger.info(f"Started sharded match engine with {num_shards} shards")
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._conns)
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, image_id: int) -> bool:
+        return image_id in self._locations
+
+    def ids(self) -> List[int]:
+        return list(self._locations)
+
+    def _call(self, shard: int, command: str, payload=None):
+        self._check()
+        try:
+            self._conns[shard].send((command, payload))
+            return self._receive(shard)
+        except Exception:
+            # The shard may have applied part of the command; its contents no
+            # longer match _locations
+            self.broken = True
+            raise
+
+    def _check(self):
+        if self.broken:
+            raise RuntimeError("Sharded match engine is broken and must be rebuilt")
+
+    def _receive(self, shard: int):
+        status, result = self._conns[shard].recv()
+        if status != "ok":
+            raise RuntimeError(f"Shard {shard} failed: {result}")
+        return result
+
+    def add(self, items: List[Tuple[int, np.ndarray]]):
+        """Insert or replace encodings, filling the smallest shards first."""
+        if not items:
+            return
+        with self._lock:
+            batches: Dict[int, List[Tuple[int, np.ndarray]]] = {}
+            heap = [(size, shard) for shard, size in enumerate(self._sizes)]
+            heapq.heapify(heap)
+            for image_id, encoding in items:
+                shard = self._locations.get(image_id)
+                if shard is None:
+                    size, shard = heapq.heappop(heap)
+                    heapq.heappush(heap, (size + 1, shard))
+                batches.setdefault(shard, []).append((image_id, encoding))
+            for shard, batch in batches.items():
+                ids = np.fromiter((image_id for image_id, _ in batch), dtype=np.int64, count=len(batch))
+                encodings = np.vstack([encoding for _, encoding in batch])
+                self._sizes[shard] = self._call(shard, "add", (ids, encodings))
+                for image_id in ids.tolist():
+                    self._locations[image_id] = shard
+
+    def remove(self, image_ids: Iterable[int]):
+        """Delete encodings and rebalance the shards if they drifted apart."""
+        with self._lock:
+            by_shard: Dict[int, List[int]] = {}
+            for image_id in image_ids:
+                shard = self._locations.pop(image_id, None)
+                if shard is not None:
+                    by_shard.setdefault(shard, []).append(image_id)
+            for shard, ids in by_shard.items():
+                self._sizes[shard] = self._call(shard, "remove", ids)
+            if by_shard:
+                self._rebalance()
+
+    def _rebalance(self):
+        mean = len(self._locations) / self.num_shards
+        while True:
+            largest = max(range(self.num_shards), key=self._sizes.__getitem__)
+            smallest = min(range(self.num_shards), key=self._sizes.__getitem__)
+            gap = self._sizes[largest] - self._sizes[smallest]
+            if gap <= max(1, REBALANCE_TOLERANCE * mean):
+                return
+            moved_ids, moved_codes = self._call(largest, "pop", gap // 2)
+            self._sizes[largest] -= len(moved_ids)
+            self._sizes[smallest] = self._call(smallest, "add_codes", (moved_ids, moved_codes))
+            for image_id in moved_ids.tolist():
+                self._locations[image_id] = smallest
+
+    def sync(self, image_ids: Iterable[int],
+             load: Callable[[List[int]], List[Tuple[int, np.ndarray]]]) -> Tuple[int, int]:
+        """Make the engine hold exactly the given ids, applying only the diff.
+
+        Args:
+            image_ids: Ids the gallery should contain
+            load: Returns (image_id, encoding) for the ids missing from the
+                engine; ids it no longer finds (deleted meanwhile) are skipped
+
+        Returns:
+            Tuple of (ids removed, ids added)
+        """
+        wanted = set(image_ids)
+        # Diff and apply in one critical section: removals from other threads
+        # (deletions, garbage collection) must not interleave
+        with self._lock:
+            stale = [image_id for image_id in self._locations if image_id not in wanted]
+            if stale:
+                self.remove(stale)
+            missing = [image_id for image_id in wanted if image_id not in self._locations]
+            added = load(missing) if missing else []
+            self.add(added)
+        return len(stale), len(added)
+
+    def search(self, query_encoding: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        """Return the k nearest gallery entries as (image_id, distance), nearest first."""
+        query = np.asarray(query_encoding, dtype=np.float64)
+        with self._lock:
+            self._check()
+            # Fan out first so every shard scans concurrently, then gather
+            sent = []
+            error = None
+            for shard, conn in enumerate(self._conns):
+                try:
+                    conn.send(("search", (query, k)))
+                    sent.append(shard)
+                except Exception as e:
+                    error = error or e
+            # Read every outstanding reply even after a failure, so no stale
+            # reply is left in a pipe for the next search to pick up
+            per_shard = []
+            for shard in sent:
+                try:
+                    per_shard.append(self._receive(shard))
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                self.broken = True
+                raise RuntimeError(f"Sharded search failed: {error}")
+        merged = itertools.islice(heapq.merge(*per_shard), k)
+        return [(image_id, distance) for distance, image_id in merged]
+
+    def close(self):
+        with self._lock:
+            for shard, conn in enumerate(self._conns):
+                try:
+                    self._call(shard, "stop")
+                except (EOFError, OSError, RuntimeError):
+                    pass
+                conn.close()
+            for process in self._processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._conns = []
+            self._processes = []
+            self._locations.clear()
@@ -0,0 +1,197 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# The middleware is only installed when enabled, so there is no per-request
+# cost at all otherwise
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# Fraction of requests profiled at random
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+# Time between stack samples of a profiled request
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+# Requests whose X-Profile header carries this token are always profiled;
+# forcing is disabled while it is empty, so anonymous clients cannot
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_HEADER = b"x-profile"
+# Bounds on the aggregated data; samples beyond them are folded into
+# OVERFLOW_LABEL so arbitrary request paths cannot grow memory without limit
+PROFILING_MAX_ROUTES = int(os.getenv("PROFILING_MAX_ROUTES", "200"))
+PROFILING_MAX_STACKS = int(os.getenv("PROFILING_MAX_STACKS", "5000"))
+OVERFLOW_LABEL = "<other>"
+# Route name of requests that did not match any route (404s for arbitrary paths)
+UNMATCHED_ROUTE = "<unmatched>"
+# Frames kept per sampled stack (innermost frames are dropped beyond this)
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame and its callers as a root-first, semicolon separated stack."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RouteProfile:
+    """Aggregated samples for one route."""
+
+    def __init__(self):
+        self.requests = 0
+        self.samples = 0
+        self.total_seconds = 0.0
+        self.stacks: Counter = Counter()
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of threads serving profiled requests.
+
+    One daemon thread wakes every ``interval`` seconds while any profiled
+    request is in flight and records the current stack of each such request's
+    thread via ``sys._current_frames``. Samples are aggregated per route in
+    collapsed-stack form ("root;child;leaf count"), the input format of
+    flamegraph.pl and speedscope.
+
+    Async endpoints share the event loop thread, so samples of concurrent
+    profiled requests on the same thread are attributed to each of them.
+    Only the thread that serves the request is sampled: work it hands to the
+    CNN face batcher, the scan thread pool or the shard processes shows up as
+    the frames waiting for that work, not as the work itself.
+    """
+
+    def __init__(self, sample_rate: float = PROFILING_SAMPLE_RATE,
+                 interval: float = PROFILING_INTERVAL_MS / 1000, token: str = PROFILING_TOKEN,
+                 max_routes: int = PROFILING_MAX_ROUTES, max_stacks: int = PROFILING_MAX_STACKS):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.token = token.encode()
+        self.max_routes = max_routes
+        self.max_stacks = max_stacks
+        self._active: Dict[int, tuple] = {}  # token -> (thread id, Counter)
+        self._next_token = 0
+        self._routes: Dict[str, RouteProfile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def should_profile(self, headers: List[tuple]) -> bool:
+        for name, value in headers:
+            if name == PROFILING_HEADER and self.token:
+                return value == self.token
+        return random.random() < self.sample_rate
+
+    def begin(self, thread_id: int) -> int:
+        """Start sampling ``thread_id`` on behalf of one request; returns a token for ``end``."""
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._active[token] = (thread_id, Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return token
+
+    def end(self, token: int, route: str, elapsed: float):
+        with self._lock:
+            _, stacks = self._active.pop(token)
+            if route not in self._routes and len(self._routes) >= self.max_routes:
+                route = OVERFLOW_LABEL
+            profile = self._routes.get(route)
+            if profile is None:
+                profile = self._routes[route] = RouteProfile()
+            profile.requests += 1
+            profile.samples += sum(stacks.values())
+            profile.total_seconds += elapsed
+            for stack, count in stacks.items():
+                if stack not in profile.stacks and len(profile.stacks) >= self.max_stacks:
+                    stack = OVERFLOW_LABEL
+                profile.stacks[stack] += count
+            if not self._active:
+                self._wake.clear()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.values():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id:
+                        stacks[collapse_stack(frame)] += 1
+            del frames
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                route: {
+                    "requests": profile.requests,
+                    "samples": profile.samples,
+                    "average_ms": profile.total_seconds / profile.requests * 1000 if profile.requests else None,
+                    "distinct_stacks": len(profile.stacks),
+                }
+                for route, profile in self._routes.items()
+            }
+
+    def collapsed(self, route: Optional[str] = None) -> str:
+        """Collapsed stacks for one route, or all routes prefixed with their name."""
+        with self._lock:
+            lines = []
+            for name, profile in self._routes.items():
+                if route is not None and name != route:
+                    continue
+                prefix = "" if route is not None else f"{name};"
+                lines.extend(f"{prefix}{stack} {count}" for stack, count in profile.stacks.most_common())
+            return "\n".join(lines) + ("\n" if lines else "")
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+def route_name(scope) -> str:
+    """Route template of a request (e.g. "POST /api/match/{image_id}") once routing has run."""
+    if "endpoint" not in scope:
+        # The router only sets the endpoint on a match; bucket all other paths together
+        return f"{scope.get('method', '')} {UNMATCHED_ROUTE}"
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path", "")
+    if route is None:
+        # Older FastAPI versions do not expose the route; restore the template from path params
+        for name, value in scope.get("path_params", {}).items():
+            path = path.replace(f"/{value}", f"/{{{name}}}")
+    return f"{scope.get('method', '')} {path}"
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles a sampled fraction of HTTP requests."""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_profile(scope.get("headers", [])):
+            await self.app(scope, receive, send)
+            return
+
+        token = self.profiler.begin(threading.get_ident())
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.end(token, route_name(scope), time.perf_counter() - started)
+
+
+profiler = SamplingProfiler()
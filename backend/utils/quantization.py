@@ -0,0 +1,167 @@
+from typing import Optional
+
+import numpy as np
+
+# Number of gallery vectors sampled to train a quantizer
+TRAINING_SAMPLE = 50000
+
+
+class Float16Quantizer:
+    """Stores encodings as half precision floats (4x smaller than float64)."""
+
+    name = "float16"
+    code_dtype = np.float16
+
+    def fit(self, encodings: np.ndarray) -> "Float16Quantizer":
+        return self
+
+    def code_shape(self, dim: int) -> tuple:
+        return (dim,)
+
+    def encode(self, encodings: np.ndarray) -> np.ndarray:
+        return np.asarray(encodings).astype(np.float16)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float64)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distances: the float query against the compressed gallery."""
+        diff = codes.astype(np.float32) - query.astype(np.float32)
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+class Int8Quantizer:
+    """Per-dimension scalar quantization to one byte (8x smaller than float64).
+
+    Each dimension is mapped linearly from the [min, max] range seen during
+    ``fit`` onto 0..255; values outside the range are clipped.
+    """
+
+    name = "int8"
+    code_dtype = np.uint8
+
+    def __init__(self):
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def fit(self, encodings: np.ndarray) -> "Int8Quantizer":
+        encodings = np.asarray(encodings, dtype=np.float64)
+        low = encodings.min(axis=0)
+        high = encodings.max(axis=0)
+        self.offset = low.astype(np.float32)
+        self.scale = np.maximum((high - low) / 255.0, 1e-12).astype(np.float32)
+        return self
+
+    def code_shape(self, dim: int) -> tuple:
+        return (dim,)
+
+    def encode(self, encodings: np.ndarray) -> np.ndarray:
+        scaled = (np.asarray(encodings, dtype=np.float32) - self.offset) / self.scale
+        return np.clip(np.rint(scaled), 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) * self.scale + self.offset).astype(np.float64)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distances computed in the code domain.
+
+        The query is mapped into code units instead of decoding the gallery, so
+        ||q - x||^2 = sum(((c - q') * scale)^2) with q' = (q - offset) / scale.
+        """
+        query_codes = (query.astype(np.float32) - self.offset) / self.scale
+        diff = codes.astype(np.float32) - query_codes
+        return np.sqrt((diff * diff) @ (self.scale * self.scale))
+
+
+class ProductQuantizer:
+    """Product quantization: each encoding becomes ``num_subspaces`` bytes.
+
+    The 128-d space is split into equal subspaces, each with its own codebook
+    of up to 256 centroids learned with k-means. Search uses asymmetric
+    distance computation: one lookup table of query-to-centroid distances per
+    query, then a gather-and-sum per gallery vector.
+    """
+
+    name = "pq"
+    code_dtype = np.uint8
+
+    def __init__(self, num_subspaces: int = 16, num_centroids: int = 256, iterations: int = 20, seed: int = 0):
+        self.num_subspaces = num_subspaces
+        self.num_centroids = num_centroids
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None  # (num_subspaces, num_centroids, subspace_dim)
+
+    def code_shape(self, dim: int) -> tuple:
+        return (self.num_subspaces,)
+
+    def _split(self, encodings: np.ndarray) -> np.ndarray:
+        n, dim = encodings.shape
+        if dim % self.num_subspaces:
+            raise ValueError(f"Encoding dimension {dim} is not divisible by {self.num_subspaces} subspaces")
+        # (num_subspaces, n, subspace_dim)
+        return encodings.reshape(n, self.num_subspaces, -1).transpose(1, 0, 2)
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (
+            np.einsum("ij,ij->i", points, points)[:, None]
+            - 2 * points @ centroids.T
+            + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        )
+        return distances.argmin(axis=1)
+
+    def fit(self, encodings: np.ndarray) -> "ProductQuantizer":
+        rng = np.random.default_rng(self.seed)
+        encodings = np.asarray(encodings, dtype=np.float32)
+        if len(encodings) > TRAINING_SAMPLE:
+            encodings = encodings[rng.choice(len(encodings), TRAINING_SAMPLE, replace=False)]
+        num_centroids = min(self.num_centroids, len(encodings))
+        codebooks = []
+        for points in self._split(encodings):
+            centroids = points[rng.choice(len(points), num_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self._nearest(points, centroids)
+                counts = np.bincount(assignment, minlength=num_centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, points)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebooks.append(centroids)
+        self.codebooks = np.stack(codebooks)
+        return self
+
+    def encode(self, encodings: np.ndarray) -> np.ndarray:
+        encodings = np.asarray(encodings, dtype=np.float32)
+        codes = np.empty((len(encodings), self.num_subspaces), dtype=np.uint8)
+        for j, points in enumerate(self._split(encodings)):
+            codes[:, j] = self._nearest(points, self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.num_subspaces)]
+        return np.concatenate(parts, axis=1).astype(np.float64)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distances via a per-query lookup table."""
+        subqueries = query.astype(np.float32).reshape(self.num_subspaces, 1, -1)
+        # table[j, c] = ||q_j - centroid_{j,c}||^2
+        table = ((self.codebooks - subqueries) ** 2).sum(axis=2)
+        squared = table[np.arange(self.num_subspaces), codes].sum(axis=1)
+        return np.sqrt(squared)
+
+
+QUANTIZERS = {
+    "float16": Float16Quantizer,
+    "int8": Int8Quantizer,
+    "pq": ProductQuantizer,
+}
+
+
+def create_quantizer(name: Optional[str]):
+    """Create an (untrained) quantizer by name; ``None``/"none" means exact float storage."""
+    if not name or name == "none":
+        return None
+    if name not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization '{name}', expected one of: none, {', '.join(QUANTIZERS)}")
+    return QUANTIZERS[name]()
@@ -0,0 +1,290 @@
+import os
+import logging
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import not_, or_
+
+from app.database import SessionLocal
+from models.image import Image
+from utils.galleries import ensure_galleries, record_change
+from utils.leases import Lease
+
+logger = logging.getLogger(__name__)
+
+# Images re-encoded per batch (one database transaction each)
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "32"))
+# Threads encoding a batch in parallel
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "2"))
+# Fraction of wall time the worker may spend encoding; it sleeps the rest
+REINDEX_DUTY_CYCLE = float(os.getenv("REINDEX_DUTY_CYCLE", "0.5"))
+# Longest the worker yields to live /upload and /match traffic before
+# processing one more batch anyway
+REINDEX_MAX_PAUSE = float(os.getenv("REINDEX_MAX_PAUSE", "5"))
+# Start re-encoding outdated images when the application starts
+REINDEX_ON_STARTUP = os.getenv("REINDEX_ON_STARTUP", "true").lower() == "true"
+# Seconds a worker process's claim on re-encoding lasts without renewal; only
+# the holder re-encodes, the other workers take over if it stops renewing
+REINDEX_LEASE_SECONDS = float(os.getenv("REINDEX_LEASE_SECONDS", "300"))
+
+# Every worker process publishes its in-flight request count here
+LIVE_TRAFFIC_DIR = os.path.join("temp", "live_traffic")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LiveTraffic:
+    """Counts in-flight latency-sensitive requests so background work can yield to them.
+
+    Each worker process writes its own count to a file named after its pid,
+    and ``active`` sums the files of all live processes, so the process
+    re-encoding also yields to requests served by the other workers on the
+    same host.
+    """
+
+    def __init__(self, directory: str = LIVE_TRAFFIC_DIR):
+        self.directory = directory
+        self._active = 0
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def active(self) -> int:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        total = 0
+        for name in names:
+            if not name.isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            if not _process_alive(int(name)):
+                # Left behind by a worker that exited
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, "rb") as f:
+                    data = f.read(8)
+            except OSError:
+                continue
+            if len(data) == 8:
+                total += struct.unpack("<q", data)[0]
+        return total
+
+    def _publish(self):
+        try:
+            pid = os.getpid()
+            if self._pid != pid:
+                # First request of this process (or of a forked child)
+                os.makedirs(self.directory, exist_ok=True)
+                self._fd = os.open(os.path.join(self.directory, str(pid)), os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = pid
+            os.pwrite(self._fd, struct.pack("<q", self._active), 0)
+        except OSError as e:
+            logger.error(f"Error publishing live traffic: {str(e)}")
+
+    async def track(self):
+        """FastAPI dependency marking a request as in flight for its duration."""
+        with self._lock:
+            self._active += 1
+            self._publish()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._publish()
+
+
+live_traffic = LiveTraffic()
+
+
+class ReindexWorker:
+    """Background re-encoding of images whose encoding signature is outdated.
+
+    Progress lives in the database: an image is done once its encoding
+    signature matches the service's, so a stopped or crashed worker resumes
+    where it left off. Within one pass images are visited in id order, so
+    images that fail to re-encode (e.g. a missing file) are skipped rather
+    than retried forever. Re-encoded references leave their old gallery and
+    join the new one, which is recorded in the same transaction.
+
+    Every worker process starts a pass, but only the holder of the "reindex"
+    lease re-encodes; the others wait and take over if the holder stops
+    renewing it (e.g. it crashed).
+    """
+
+    def __init__(self, face_service, session_factory=SessionLocal,
+                 batch_size: int = REINDEX_BATCH_SIZE, workers: int = REINDEX_WORKERS,
+                 duty_cycle: float = REINDEX_DUTY_CYCLE, traffic: LiveTraffic = live_traffic,
+                 lease: Optional[Lease] = None):
+        if not 0 < duty_cycle <= 1:
+            raise ValueError(f"duty_cycle must be in (0, 1], got {duty_cycle}")
+        self.face_service = face_service
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.workers = workers
+        self.duty_cycle = duty_cycle
+        self.traffic = traffic
+        self.lease = lease or Lease("reindex", REINDEX_LEASE_SECONDS, session_factory)
+        self._claimed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._progress = {"reencoded": 0, "failed": 0, "cursor": 0, "started_at": None, "finished_at": None}
+        # Images of the current pass that could not be re-encoded; reported
+        # separately from the remaining count, and retried by the next pass
+        self._failed_ids: List[int] = []
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """Start a pass over outdated images; returns False if one is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._progress = {"reencoded": 0, "failed": 0, "cursor": 0,
+                              "started_at": time.time(), "finished_at": None}
+            self._failed_ids = []
+            self._thread = threading.Thread(target=self._run, name="reindex-worker", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+
+    def _outdated(self, db):
+        signature = self.face_service.encoding_signature()
+        # Rows encoded before signatures existed have NULL columns, which a
+        # negated comparison alone would not select
+        return db.query(Image).filter(or_(
+            Image.encoding_model == None,
+            not_(Image.with_encoding_signature(signature))
+        ))
+
+    def status(self) -> Dict:
+        failed_ids = list(self._failed_ids)
+        db = self.session_factory()
+        try:
+            outdated = self._outdated(db)
+            if failed_ids:
+                outdated = outdated.filter(not_(Image.id.in_(failed_ids)))
+            remaining = outdated.count()
+        finally:
+            db.close()
+        return {
+            "running": self.running,
+            "signature": self.face_service.encoding_signature(),
+            "remaining": remaining,
+            "failed_ids": failed_ids,
+            # Whether this worker process is the one re-encoding
+            "claimed": self._claimed,
+            **self._progress,
+        }
+
+    def _yield_to_traffic(self):
+        """Wait for live requests to drain, but never longer than REINDEX_MAX_PAUSE."""
+        deadline = time.monotonic() + REINDEX_MAX_PAUSE
+        while self.traffic.active > 0 and time.monotonic() < deadline and not self._stop.is_set():
+            time.sleep(0.05)
+
+    def _run(self):
+        logger.info(f"Re-encoding images for signature {self.face_service.encoding_signature()}")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stop.is_set():
+                self._claimed = self.lease.acquire()
+                if not self._claimed:
+                    # Another worker process is re-encoding
+                    self._stop.wait(self.lease.ttl / 2)
+                    continue
+                self._yield_to_traffic()
+                started = time.monotonic()
+                if not self._process_batch(executor):
+                    break
+                # Throttle to the duty cycle so live requests keep most of the CPU
+                busy = time.monotonic() - started
+                self._stop.wait(busy * (1 - self.duty_cycle) / self.duty_cycle)
+        if self._claimed:
+            self.lease.release()
+            self._claimed = False
+        self._progress["finished_at"] = time.time()
+        logger.info(f"Re-encoding finished: {self._progress['reencoded']} re-encoded, "
+                    f"{self._progress['failed']} failed")
+
+    def _process_batch(self, executor) -> bool:
+        """Re-encode the next batch; returns False when no outdated images remain."""
+        db = self.session_factory()
+        try:
+            images = self._outdated(db).filter(
+                Image.id > self._progress["cursor"]
+            ).order_by(Image.id).limit(self.batch_size).all()
+            if not images:
+                return False
+
+            signature = self.face_service.encoding_signature()
+            paths = [image.filepath for image in images]
+            if self.face_service.models["face_recognition"] == "cnn":
+                # The CNN path already batches detection across the whole list
+                results = self.face_service.locate_and_encode_faces(paths)
+            else:
+                results = list(executor.map(self.face_service.locate_and_encode_face, paths))
+
+            # Renew before the first write: if encoding outlasted the lease,
+            # another worker may be re-encoding the same images
+            if not self.lease.acquire():
+                self._claimed = False
+                logger.info("Reindex lease lost; leaving the batch to its new holder")
+                return True
+
+            # Create missing gallery counter rows before the first change to
+            # this session, which would otherwise lock them out on SQLite
+            ensure_galleries(db, {image.encoding_signature for image in images if image.is_reference} | {signature})
+
+            moved: Dict[tuple, int] = {}
+            for image, located_face in zip(images, results):
+                if located_face is None:
+                    self._progress["failed"] += 1
+                    self._failed_ids.append(image.id)
+                    continue
+                if image.is_reference:
+                    moved[image.encoding_signature] = moved.get(image.encoding_signature, 0) + 1
+                image.face_encoding = self.face_service.encode_to_base64(located_face[1])
+                image.encoding_model, image.encoding_detector, image.encoding_version = signature
+                self._progress["reencoded"] += 1
+
+            # Re-encoded references join the new gallery under older ids, so
+            # both galleries need a full rescan rather than an incremental one
+            for old_signature, count in moved.items():
+                record_change(db, old_signature, removed=count)
+            if moved:
+                record_change(db, signature, added=sum(moved.values()), invalidate=True)
+            db.commit()
+            self._progress["cursor"] = images[-1].id
+            return True
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error re-encoding images: {str(e)}")
+            return False
+        finally:
+            db.close()
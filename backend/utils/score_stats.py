@@ -0,0 +1,162 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Similarity = 1 - face distance; dlib distances stay well below 2
+SCORE_MIN = -1.0
+SCORE_MAX = 1.0
+SCORE_BINS = 400
+
+# At most this many impostor scores are sampled per scan, keeping the update
+# cost constant however large the gallery is
+IMPOSTOR_SAMPLE_SIZE = int(os.getenv("MATCH_STATS_IMPOSTOR_SAMPLE", "1024"))
+# Early exit is only calibrated once this many impostor scores were seen
+EARLY_EXIT_MIN_SAMPLES = int(os.getenv("MATCH_EARLY_EXIT_MIN_SAMPLES", "100000"))
+# Highest tolerated fraction of impostor scores above the early-exit threshold
+EARLY_EXIT_IMPOSTOR_RATE = float(os.getenv("MATCH_EARLY_EXIT_IMPOSTOR_RATE", "1e-5"))
+
+
+class ScoreHistogram:
+    """Fixed-bin streaming histogram of similarity scores."""
+
+    def __init__(self, bins: int = SCORE_BINS, low: float = SCORE_MIN, high: float = SCORE_MAX):
+        self.low = low
+        self.high = high
+        self.bin_width = (high - low) / bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.total = 0
+
+    def add(self, scores: np.ndarray):
+        scores = np.atleast_1d(np.asarray(scores, dtype=np.float64))
+        if scores.size == 0:
+            return
+        indices = ((scores - self.low) / self.bin_width).astype(np.int64)
+        np.clip(indices, 0, len(self.counts) - 1, out=indices)
+        self.counts += np.bincount(indices, minlength=len(self.counts))
+        self.total += scores.size
+
+    def edge(self, index: int) -> float:
+        return self.low + index * self.bin_width
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate quantile (upper edge of the bin containing it)."""
+        if self.total == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), q * self.total))
+        return self.edge(min(index + 1, len(self.counts)))
+
+    def threshold_for_tail(self, max_fraction: float) -> float:
+        """Lowest bin edge with at most ``max_fraction`` of the scores at or above it."""
+        # tail[i] = number of scores in bins i and above
+        tail = np.cumsum(self.counts[::-1])[::-1]
+        allowed = max_fraction * self.total
+        index = int(np.argmax(tail <= allowed)) if tail[-1] <= allowed else len(self.counts)
+        return self.edge(index)
+
+    def to_dict(self) -> Dict:
+        nonzero = np.nonzero(self.counts)[0]
+        return {
+            "total": int(self.total),
+            "bin_width": self.bin_width,
+            "bins": {f"{self.edge(i):.3f}": int(self.counts[i]) for i in nonzero},
+        }
+
+
+class GalleryScoreStats:
+    """Best-match and impostor score distributions for one gallery."""
+
+    def __init__(self):
+        self.best = ScoreHistogram()
+        self.impostor = ScoreHistogram()
+        self.scans = 0
+        self.early_exits = 0
+        self.scanned = 0
+        self.gallery_size = 0
+        self._lock = threading.Lock()
+
+    def record_scan(self, similarities: Optional[np.ndarray], best_similarity: float,
+                    scanned: int, gallery_size: int, early_exit: bool = False):
+        """
+        Update the statistics after one query.
+
+        Args:
+            similarities: Scores computed during the scan, or None if not available
+                (e.g. the sharded engine only returns its top candidates)
+            best_similarity: Score of the best candidate
+            scanned: Number of gallery entries actually compared
+            gallery_size: Number of entries in the gallery
+            early_exit: Whether the scan stopped early
+        """
+        impostors = None
+        if similarities is not None and len(similarities) > 1:
+            # Everything but the best candidate counts as an impostor score
+            stride = max(1, len(similarities) // IMPOSTOR_SAMPLE_SIZE)
+            impostors = similarities[::stride]
+            best_index = int(np.argmax(similarities))
+            if best_index % stride == 0:
+                impostors = np.delete(impostors, best_index // stride)
+        with self._lock:
+            self.best.add(best_similarity)
+            if impostors is not None:
+                self.impostor.add(impostors)
+            self.scans += 1
+            self.early_exits += int(early_exit)
+            self.scanned += scanned
+            self.gallery_size = gallery_size
+
+    def early_exit_threshold(self, floor: float) -> Optional[float]:
+        """Score above which a candidate is a near-certain match, or None if not yet calibrated.
+
+        The threshold sits above all but ``EARLY_EXIT_IMPOSTOR_RATE`` of the
+        impostor scores seen so far and never below ``floor`` (the match threshold).
+        """
+        with self._lock:
+            if self.impostor.total < EARLY_EXIT_MIN_SAMPLES:
+                return None
+            return max(floor, self.impostor.threshold_for_tail(EARLY_EXIT_IMPOSTOR_RATE))
+
+    def to_dict(self, floor: float) -> Dict:
+        threshold = self.early_exit_threshold(floor)
+        with self._lock:
+            return {
+                "scans": self.scans,
+                "early_exits": self.early_exits,
+                "average_scanned_fraction": (
+                    self.scanned / (self.scans * self.gallery_size) if self.scans and self.gallery_size else None
+                ),
+                "gallery_size": self.gallery_size,
+                "early_exit_threshold": threshold,
+                "best_match": {
+                    "p01": self.best.quantile(0.01),
+                    "p10": self.best.quantile(0.10),
+                    "p50": self.best.quantile(0.50),
+                    **self.best.to_dict(),
+                },
+                "impostor": {
+                    "p50": self.impostor.quantile(0.50),
+                    "p99": self.impostor.quantile(0.99),
+                    "p999": self.impostor.quantile(0.999),
+                    **self.impostor.to_dict(),
+                },
+            }
+
+
+class ScoreStatsRegistry:
+    """Per-gallery score statistics, created on first use."""
+
+    def __init__(self):
+        self._galleries: Dict[str, GalleryScoreStats] = {}
+        self._lock = threading.Lock()
+
+    def get(self, gallery: str) -> GalleryScoreStats:
+        with self._lock:
+            stats = self._galleries.get(gallery)
+            if stats is None:
+                stats = self._galleries[gallery] = GalleryScoreStats()
+            return stats
+
+    def galleries(self) -> List[str]:
+        with self._lock:
+            return list(self._galleries)
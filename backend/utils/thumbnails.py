@@ -0,0 +1,114 @@
+import os
+import logging
+import tempfile
+from typing import Optional, Tuple
+
+from PIL import Image as PILImage, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Derivatives live next to the originals so they share the uploads volume
+DERIVED_DIR = os.path.join("uploads", "derived")
+
+# Longest edge of a thumbnail, in pixels
+THUMBNAIL_SIZE = 400
+# Edge of the square face crop, in pixels
+FACE_CROP_SIZE = 160
+# Extra context around the detected face box, as a fraction of its size
+FACE_CROP_MARGIN = 0.3
+JPEG_QUALITY = 85
+
+# EXIF orientation tag values and the transpose that undoes each one
+_EXIF_ORIENTATION = 0x0112
+_ORIENTATION_TRANSPOSE = {
+    2: PILImage.Transpose.FLIP_LEFT_RIGHT,
+    3: PILImage.Transpose.ROTATE_180,
+    4: PILImage.Transpose.FLIP_TOP_BOTTOM,
+    5: PILImage.Transpose.TRANSPOSE,
+    6: PILImage.Transpose.ROTATE_270,
+    7: PILImage.Transpose.TRANSVERSE,
+    8: PILImage.Transpose.ROTATE_90,
+}
+
+DERIVATIVE_KINDS = ("thumbnail", "face")
+
+
+def derivative_path(kind: str, filename: str) -> str:
+    """Path of a derivative for an uploaded file (always stored as JPEG)."""
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(DERIVED_DIR, kind, f"{stem}.jpg")
+
+
+def _save_atomically(image: PILImage.Image, dest_path: str):
+    """Write via a temporary file so concurrent readers never see a partial JPEG."""
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            image.convert("RGB").save(tmp_file, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def create_thumbnail(source_path: str, dest_path: str, size: int = THUMBNAIL_SIZE):
+    """Downscale an image so its longest edge is at most ``size`` pixels."""
+    with PILImage.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), PILImage.Resampling.LANCZOS)
+        _save_atomically(image, dest_path)
+
+
+def create_face_crop(source_path: str, dest_path: str, location: Tuple[int, int, int, int],
+                     size: int = FACE_CROP_SIZE):
+    """
+    Crop the face at ``location`` to a square of ``size`` pixels.
+
+    Args:
+        source_path: Path to the original image
+        dest_path: Where to write the crop
+        location: Face box as (top, right, bottom, left), as returned by face_recognition
+        size: Edge of the output square
+    """
+    top, right, bottom, left = location
+    margin = int(max(bottom - top, right - left) * FACE_CROP_MARGIN)
+    with PILImage.open(source_path) as image:
+        # face_recognition reports boxes in raw pixel orientation: crop first,
+        # then apply the EXIF orientation to the crop only
+        box = (
+            max(0, left - margin),
+            max(0, top - margin),
+            min(image.width, right + margin),
+            min(image.height, bottom + margin),
+        )
+        crop = image.crop(box)
+        transpose = _ORIENTATION_TRANSPOSE.get(image.getexif().get(_EXIF_ORIENTATION))
+        if transpose is not None:
+            crop = crop.transpose(transpose)
+        crop = ImageOps.fit(crop, (size, size), PILImage.Resampling.LANCZOS)
+        _save_atomically(crop, dest_path)
+
+
+def generate_derivatives(source_path: str, filename: str,
+                         face_location: Optional[Tuple[int, int, int, int]] = None):
+    """Create the thumbnail (and face crop, if the face box is known) for an upload.
+
+    Failures are logged rather than raised: derivatives are regenerated lazily
+    on first request, so they must never fail an upload.
+    """
+    try:
+        create_thumbnail(source_path, derivative_path("thumbnail", filename))
+        if face_location is not None:
+            create_face_crop(source_path, derivative_path("face", filename), face_location)
+    except Exception as e:
+        logger.error(f"Error generating derivatives for {filename}: {str(e)}")
+
+
+def remove_derivatives(filename: str):
+    """Delete every derivative of an upload, ignoring ones that were never generated."""
+    for kind in DERIVATIVE_KINDS:
+        try:
+            os.remove(derivative_path(kind, filename))
+        except FileNotFoundError:
+            pass
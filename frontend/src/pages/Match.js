@@ -170,7 +170,7 @@ const MatchPage = () => {
                 {selectedImage && (
                   <div style={{ textAlign: 'center' }}>
                     <img
-                      src={`/uploads/${selectedImage.filepath.split('/').pop()}`}
+                      src={selectedImage.thumbnail_url}
                       alt="Selected"
                       style={{ maxWidth: '100%', maxHeight: 300, marginBottom: 16 }}
                     />
@@ -239,7 +239,7 @@ const MatchPage = () => {
               <div>
                 <div style={{ textAlign: 'center', marginBottom: 16 }}>
                   <img
-                    src={`/uploads/${matchResult.matched_image.filepath.split('/').pop()}`}
+                    src={matchResult.matched_image.thumbnail_url}
                     alt="Matched"
                     style={{ maxWidth: '100%', maxHeight: 300 }}
                   />
@@ -159,7 +159,7 @@ const UploadPage = () => {
             {uploadedImage ? (
               <div style={{ textAlign: 'center' }}>
                 <img
-                  src={`/uploads/${uploadedImage.filepath.split('/').pop()}`}
+                  src={uploadedImage.thumbnail_url}
                   alt="Uploaded"
                   style={{ maxWidth: '100%', maxHeight: 400 }}
                 />
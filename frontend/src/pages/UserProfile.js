@@ -106,7 +106,7 @@ const UserProfile = () => {
                     <List.Item.Meta
                       avatar={
                         <Avatar 
-                          src={`/uploads/${item.matched_image.filepath.split('/').pop()}`} 
+                          src={item.matched_image.face_url} 
                           icon={<UserOutlined />}
                         />
                       }
@@ -136,7 +136,7 @@ const UserProfile = () => {
                       cover={
                         <img 
                           alt={item.filename} 
-                          src={`/uploads/${item.filepath.split('/').pop()}`}
+                          src={item.thumbnail_url}
                           style={{ height: 200, objectFit: 'cover' }}
                         />
                       }